@@ -0,0 +1,210 @@
+"""
+**generators.py**
+
+* *Purpose:* Deterministic synthetic inputs for the benchmarks: MOHID HDF5 and CF NetCDF outputs,
+  ALOHA KML exports and CEDRE POLREP documents of configurable size. The same size and seed
+  always write the same file.
+
+"""
+
+import copy
+import json
+import os
+import uuid
+from functools import lru_cache
+from datetime import datetime, timedelta
+import numpy as np
+
+# Grid and start of the synthetic MOHID runs (Ria de Arousa)
+LONGITUDE_RANGE = (-9.0, -8.0)
+LATITUDE_RANGE = (42.0, 42.8)
+START_DATE = datetime(2025, 10, 29, 9, 0, 0)
+TIME_STEP = timedelta(minutes=10)
+
+AIR_CONCENTRATION_PATH = '/Results/Spill Location/Data_2D/AirConcentration_2D/AirConcentration_2D_'
+
+# Threat zones written to the ALOHA exports: (name, colour) like ALOHA's own AEGL folder
+ALOHA_ZONES = [('Yellow Threat Zone 30 ppm = AEGL-1 (60 min)', 'ffff00'),
+               ('Orange Threat Zone 160 ppm = AEGL-2 (60 min)', 'ff9900'),
+               ('Red Threat Zone 1100 ppm = AEGL-3 (60 min)', 'ff0000')]
+
+SAMPLE_POLREP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'data', 'samples', 'cedre_json.json')
+
+
+def get_plume(n_longitudes, n_latitudes, n_time, rng):
+    """Concentration [lon, lat] of a gaussian plume drifting east at timestep n_time, with some noise."""
+    x, y = np.meshgrid(np.linspace(0, 1, n_longitudes), np.linspace(0, 1, n_latitudes), indexing='ij')
+    centre_x, centre_y = 0.15 + 0.05 * n_time, 0.5 + 0.1 * np.sin(n_time / 4)
+    field = 1000 * np.exp(-((x - centre_x) ** 2 / 0.02 + (y - centre_y) ** 2 / 0.01))
+    return (field * (1 + 0.05 * rng.standard_normal(field.shape))).clip(min=0)
+
+
+def get_dates(n_times):
+    return [START_DATE + n * TIME_STEP for n in range(n_times)]
+
+
+def make_mohid_hdf5(file_out, n_longitudes=200, n_latitudes=150, n_times=48, n_particles=0, seed=0):
+    """
+    MOHID Lagrangian HDF5: 2D corner grid, /Time/Time_xxxxx date vectors and one
+    AirConcentration_2D [lon, lat] dataset per timestep (contiguous, as MOHID writes them).
+    With n_particles, the particle positions are written under /Results/spill too.
+    """
+    import h5py
+    rng = np.random.default_rng(seed)
+    longitudes = np.linspace(*LONGITUDE_RANGE, n_longitudes + 1)
+    latitudes = np.linspace(*LATITUDE_RANGE, n_latitudes + 1)
+    grid_longitudes, grid_latitudes = np.meshgrid(longitudes, latitudes, indexing='ij')
+    with h5py.File(file_out, 'w') as f:
+        f['/Grid/Longitude'] = grid_longitudes
+        f['/Grid/Latitude'] = grid_latitudes
+        for n, date in enumerate(get_dates(n_times)):
+            key = str(n + 1).zfill(5)
+            f['/Time/Time_' + key] = np.array([date.year, date.month, date.day,
+                                               date.hour, date.minute, date.second], dtype=float)
+            f[AIR_CONCENTRATION_PATH + key] = get_plume(n_longitudes, n_latitudes, n, rng)
+            if n_particles:
+                f['/Results/spill/Latitude/Latitude_' + key] = \
+                    LATITUDE_RANGE[0] + 0.4 + 0.05 * rng.standard_normal(n_particles)
+                f['/Results/spill/Longitude/Longitude_' + key] = \
+                    LONGITUDE_RANGE[0] + 0.15 + 0.01 * n + 0.05 * rng.standard_normal(n_particles)
+    return file_out
+
+
+def make_mohid_netcdf(file_out, n_longitudes=200, n_latitudes=150, n_times=48, seed=0):
+    """CF NetCDF of the same plume: time, latitude and longitude axes and a [time, lat, lon] variable."""
+    import netCDF4
+    rng = np.random.default_rng(seed)
+    with netCDF4.Dataset(file_out, 'w') as dataset:
+        dataset.createDimension('time', n_times)
+        dataset.createDimension('latitude', n_latitudes)
+        dataset.createDimension('longitude', n_longitudes)
+        times = dataset.createVariable('time', 'f8', ('time',))
+        times.standard_name = 'time'
+        times.units = f'minutes since {START_DATE:%Y-%m-%d %H:%M:%S}'
+        times[:] = np.arange(n_times) * TIME_STEP.total_seconds() / 60
+        latitudes = dataset.createVariable('latitude', 'f8', ('latitude',))
+        latitudes.standard_name = 'latitude'
+        latitudes[:] = np.linspace(*LATITUDE_RANGE, n_latitudes)
+        longitudes = dataset.createVariable('longitude', 'f8', ('longitude',))
+        longitudes.standard_name = 'longitude'
+        longitudes[:] = np.linspace(*LONGITUDE_RANGE, n_longitudes)
+        concentration = dataset.createVariable('air_concentration', 'f4', ('time', 'latitude', 'longitude'))
+        concentration.long_name = 'air_concentration_2D'
+        for n in range(n_times):
+            concentration[n] = get_plume(n_longitudes, n_latitudes, n, rng).T
+    return file_out
+
+
+def get_ring(centre, radius, n_points, rng):
+    """Closed, slightly irregular ring of n_points around centre (lon, lat)."""
+    angles = np.linspace(0, 2 * np.pi, n_points, endpoint=False)
+    radii = radius * (1 + 0.1 * rng.random(n_points))
+    ring = np.column_stack((centre[0] + radii * np.cos(angles), centre[1] + 0.75 * radii * np.sin(angles)))
+    return np.vstack((ring, ring[:1]))
+
+
+def make_aloha_kml(file_out, n_placemarks=3, ring_length=2000, seed=0):
+    """
+    ALOHA-like KML: an "Aloha Threat Zones" folder with n_placemarks polygons cycling through the
+    AEGL threat zones (nested, largest first), each with ring_length vertices, and a source point.
+    """
+    rng = np.random.default_rng(seed)
+    centre = (-8.67, 42.29)
+    placemarks = []
+    for n in range(n_placemarks):
+        name, colour = ALOHA_ZONES[n % len(ALOHA_ZONES)]
+        ring = get_ring(centre, 0.02 / (1 + n % len(ALOHA_ZONES)) * (1 + n // len(ALOHA_ZONES)), ring_length, rng)
+        coordinates = ' '.join(f'{lon:.6f},{lat:.6f}' for lon, lat in ring)
+        placemarks.append(f''' <Placemark>
+  <name>{name}</name>
+  <description><![CDATA[<b>Chemical Name:</b> AMMONIA<br>Model: ALOHA Gaussian<br>]]></description>
+  <Style><PolyStyle><color>7f{colour}</color></PolyStyle></Style>
+  <Polygon><outerBoundaryIs><LinearRing><coordinates>{coordinates}</coordinates></LinearRing></outerBoundaryIs></Polygon>
+ </Placemark>''')
+    document = f'''<?xml version="1.0" encoding="utf-8" ?>
+<kml xmlns="http://www.opengis.net/kml/2.2"  xmlns:gx="http://www.google.com/kml/ext/2.2">
+<Document>
+<Folder><name>Aloha Threat Zones</name>
+{chr(10).join(placemarks)}
+</Folder>
+<Folder><name>Aloha Points</name>
+ <Placemark><name>ALOHA Source Point</name><Point><coordinates>{centre[0]},{centre[1]}</coordinates></Point></Placemark>
+</Folder>
+</Document>
+</kml>
+'''
+    with open(file_out, 'w', encoding='utf-8') as f:
+        f.write(document)
+    return file_out
+
+
+def make_polrep(file_out, n_pollutions=100, n_positions=10, n_messages=50, n_bulletins=50, seed=0, chrono=None):
+    """
+    POLREP document built from the CEDRE sample: the sample pollution, message and meteo bulletin
+    are repeated (n_positions positions per pollution) with fresh deterministic UUIDs and dates.
+    """
+    document = get_polrep(n_pollutions, n_positions, n_messages, n_bulletins, seed, chrono)
+    with open(file_out, 'w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=False)
+    return file_out
+
+
+def make_polrep_export(file_out, n_incidents=1000, n_pollutions=2, n_positions=5, n_messages=2, n_bulletins=2,
+                       ndjson=True, seed=0):
+    """Bulk export of n_incidents POLREP documents (see make_polrep), as NDJSON or as a JSON array."""
+    with open(file_out, 'w', encoding='utf-8') as f:
+        f.write('' if ndjson else '[')
+        for n in range(n_incidents):
+            document = get_polrep(n_pollutions, n_positions, n_messages, n_bulletins, seed * n_incidents + n,
+                                  f'EXPORT-{seed}-{n}')
+            separator = '\n' if ndjson else (',\n' if n < n_incidents - 1 else '')
+            f.write(json.dumps(document, ensure_ascii=False) + separator)
+        f.write('' if ndjson else ']')
+    return file_out
+
+
+@lru_cache(maxsize=None)
+def get_sample_polrep():
+    with open(SAMPLE_POLREP, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def get_polrep(n_pollutions=100, n_positions=10, n_messages=50, n_bulletins=50, seed=0, chrono=None):
+    """POLREP document of make_polrep, as a dict."""
+    rng = np.random.default_rng(seed)
+
+    def new_uuid():
+        return str(uuid.UUID(bytes=rng.bytes(16), version=4))
+
+    def new_date(n):
+        return (START_DATE + n * timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    sample = get_sample_polrep()
+    document = copy.deepcopy(sample)
+    pollution, message, bulletin = sample['pollutions'][0], sample['messages'][0], sample['bulletinsMeteo'][0]
+    position = pollution['positions'][0]
+
+    document['pollutions'] = []
+    for n in range(n_pollutions):
+        new_pollution = copy.deepcopy(pollution)
+        new_pollution['uuid'], new_pollution['gdh'] = new_uuid(), new_date(n)
+        new_pollution['positions'] = []
+        for m in range(n_positions):
+            new_position = copy.deepcopy(position)
+            new_position['uuid'], new_position['gdh'] = new_uuid(), new_date(n + m)
+            new_position['location']['latitudeDD'] = round(position['location']['latitudeDD'] + rng.normal(0, 0.1), 6)
+            new_position['location']['longitudeDD'] = round(position['location']['longitudeDD'] + rng.normal(0, 0.1), 6)
+            new_pollution['positions'].append(new_position)
+        document['pollutions'].append(new_pollution)
+    document['messages'] = [dict(message, dateTransmission=new_date(n)) for n in range(n_messages)]
+    document['bulletinsMeteo'] = []
+    for n in range(n_bulletins):
+        new_bulletin = copy.deepcopy(bulletin)
+        new_bulletin['uuid'], new_bulletin['gdh'] = new_uuid(), new_date(n)
+        document['bulletinsMeteo'].append(new_bulletin)
+    if document['pollutions']:
+        document['pollutionPrincipal'] = document['pollutions'][0]['uuid']
+    if chrono is not None:
+        document['chrono'] = chrono
+    return document
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+run_benchmarks: Stage-by-stage timings of the COPTool_Utils ingestion workflows.
+
+Technical Description:
+    Generates deterministic synthetic inputs (MOHID HDF5/NetCDF, ALOHA KML and
+    CEDRE POLREP, see generators.py) and times every stage of each workflow on
+    its own: reader open, time axis, maximum reduction, particle rasterization,
+    contouring, WKT/WKB encoding and database load. The load runs against a
+    local stand-in of the database (standin.py) unless "database" is true, in
+    which case config/db.json is used. Results are written as JSON so runs of
+    different releases can be compared.
+
+    The "imports" workflow times the cold import of every tool in a fresh
+    interpreter, with the packages that cost the most, and exits with an error
+    when a tool goes over its budget (seconds) in "imports".
+
+Run from this directory with the repository root on PYTHONPATH:
+    python run_benchmarks.py
+"""
+
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+# The tools are scripts run from their own directory, not packages
+sys.path.extend([os.path.join(ROOT_DIR, 'tools', tool) for tool in ('mohid2cop', 'aloha2cop', 'cedre_json2cop')])
+
+import shapely
+from common.readers.inout import read_input
+from common.database.geometry import to_wkb
+from common.database.cop_sql import CopQuery
+from common.database.cedre_sql import CedreQuery
+from common.readers.prefetch import Prefetcher
+from mohid_reader import LagrangianFile, IsolineExtractor
+from aloha_reader import Aloha
+from cedre_json2cop import read_batches, load_batch
+import generators
+from standin import StandInConnection, make_query
+
+CAMPAIGN = {'name': 'BENCHMARK', 'description': 'Synthetic benchmark inputs'}
+MODEL = 'MOHID'
+INITIAL_DATE = datetime(2025, 10, 29, 9, 0, 0)
+# Heaviest packages reported per tool by the import profile
+N_TOP_IMPORTS = 5
+
+# Run in a fresh interpreter: time of the imports of one tool, as the CLI loads it
+IMPORT_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+from common.tools import load_tool
+load_tool(sys.argv[1])
+print(time.perf_counter() - start)
+'''
+
+
+class Benchmark:
+    """Runs and records the stages of every workflow."""
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.repeat = inputs.get('repeat', 3)
+        self.precision = inputs.get('precision', 6)
+        self.work_dir = os.path.abspath(inputs.get('work dir', 'inputs'))
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.results = []
+
+    def time_stage(self, workflow, stage, function, release=None, **info):
+        """
+        Time function (best and mean of `repeat` runs, output silenced) and return its last value.
+        release, if given, is called untimed on the value of every other run (e.g. to close a file).
+        """
+        timings, value = [], None
+        for n in range(self.repeat):
+            if n and release is not None:
+                release(value)
+            start = time.perf_counter()
+            with redirect_stdout(io.StringIO()):
+                value = function()
+            timings.append(time.perf_counter() - start)
+        self.results.append({'workflow': workflow, 'stage': stage, 'best': min(timings),
+                             'mean': sum(timings) / len(timings), 'timings': timings, **info})
+        print(f'{workflow:<14} {stage:<12} {min(timings):10.4f} s')
+        return value
+
+    def get_query(self, query_class):
+        """A query on the configured database, or on a fresh stand-in; returns (query, stand-in or None)."""
+        if self.inputs.get('database'):
+            query = query_class()
+            query.connect()
+            return query, None
+        connection = StandInConnection(self.inputs.get('latency', 0.0))
+        return make_query(query_class, connection), connection
+
+    def release(self, query, connection):
+        if connection is None:
+            query.close()
+
+    def get_input(self, name, make, **options):
+        """Path of a generated input, written only if it is not in the work directory yet."""
+        path = os.path.join(self.work_dir, name)
+        if not os.path.exists(path):
+            make(path, **options)
+        return path
+
+    def run_mohid(self):
+        mohid = self.inputs.get('mohid') or {}
+        n_longitudes, n_latitudes = mohid.get('longitudes', 200), mohid.get('latitudes', 150)
+        n_times, n_particles = mohid.get('timesteps', 48), mohid.get('particles', 0)
+        levels = mohid.get('levels', [20.896, 111.44, 766.18])
+        size = f'{n_longitudes}x{n_latitudes}x{n_times}'
+        files = {'mohid hdf5': self.get_input(f'mohid_{size}_{n_particles}.hdf5', generators.make_mohid_hdf5,
+                                              n_longitudes=n_longitudes, n_latitudes=n_latitudes,
+                                              n_times=n_times, n_particles=n_particles),
+                 'mohid netcdf': self.get_input(f'mohid_{size}.nc', generators.make_mohid_netcdf,
+                                                n_longitudes=n_longitudes, n_latitudes=n_latitudes,
+                                                n_times=n_times)}
+        for workflow, file_in in files.items():
+            info = {'grid': [n_latitudes, n_longitudes], 'timesteps': n_times}
+            lag = self.time_stage(workflow, 'open', lambda: LagrangianFile(file_in),
+                                  release=lambda lag: lag.reader.close(), **info)
+            try:
+                self.time_stage(workflow, 'time axis', lag.reader.get_time_index, **info)
+                maximum = self.time_stage(workflow, 'maximum',
+                                          lambda: lag.get_maximum_field('air_concentration_2D'), **info)
+                if n_particles and workflow == 'mohid hdf5':
+                    self.time_stage(workflow, 'rasterize',
+                                    lambda: [lag.get_particle_field('particle_density', n_time)
+                                             for n_time in lag.time_keys], particles=n_particles, **info)
+                extractor = IsolineExtractor(lag.longitudes, lag.latitudes, maximum, levels)
+                # Marching squares and coordinate mapping alone, then with the polygons built
+                self.time_stage(workflow, 'contours', extractor.extract_contours, levels=len(levels))
+                isolines = self.time_stage(workflow, 'contouring', extractor.extract_isolines, levels=len(levels))
+                self.time_stage_encoding(workflow, [isoline for isoline in isolines if isoline is not None])
+                names = [f'AEGL-{n + 1}' for n in range(len(levels))]
+                self.time_stage_load(workflow, lambda query: self.load_lines(query, workflow, 'AEGL',
+                                                                             zip(names, isolines)))
+            finally:
+                lag.reader.close()
+
+    def run_aloha(self):
+        aloha = self.inputs.get('aloha') or {}
+        n_files, n_placemarks, ring_length = aloha.get('files', 10), aloha.get('placemarks', 3), \
+            aloha.get('ring length', 2000)
+        files = [self.get_input(f'aloha_{n_placemarks}x{ring_length}_{n}.kml', generators.make_aloha_kml,
+                                n_placemarks=n_placemarks, ring_length=ring_length, seed=n)
+                 for n in range(n_files)]
+        info = {'files': n_files, 'placemarks': n_placemarks, 'ring length': ring_length}
+        alohas = self.time_stage('aloha', 'parse', lambda: [Aloha(file) for file in files], **info)
+        geometries = [threat_zone.geometry for aloha_file in alohas for threat_zone in aloha_file.threat_zones]
+        self.time_stage_encoding('aloha', geometries)
+
+        def load(query):
+            for n, aloha_file in enumerate(alohas):
+                self.load_lines(query, f'aloha {n}', 'AEGL',
+                                [(threat_zone.level, threat_zone.geometry) for threat_zone in aloha_file.threat_zones])
+        self.time_stage_load('aloha', load)
+
+    def run_polrep(self):
+        polrep = self.inputs.get('polrep') or {}
+        options = {'n_pollutions': polrep.get('pollutions', 100), 'n_positions': polrep.get('positions', 10),
+                   'n_messages': polrep.get('messages', 50), 'n_bulletins': polrep.get('bulletins', 50)}
+        file_in = self.get_input('polrep_{n_pollutions}x{n_positions}_{n_messages}_{n_bulletins}.json'
+                                 .format(**options), generators.make_polrep, **options)
+
+        def parse():
+            with open(file_in, encoding='utf-8') as f:
+                return json.load(f)
+        document = self.time_stage('polrep', 'parse', parse, **options)
+        self.time_stage_load('polrep', lambda query: query.insert_incident_document(document), CedreQuery)
+
+        # Bulk export of many incidents, streamed and loaded in batches as cedre_json2cop does
+        export = polrep.get('export')
+        if not export:
+            return
+        n_incidents, batch_size = export.get('incidents', 1000), export.get('batch size', CedreQuery.BATCH_SIZE)
+        ndjson = export.get('ndjson', True)
+        export_file = self.get_input(f'polrep_export_{n_incidents}.{"ndjson" if ndjson else "json"}',
+                                     generators.make_polrep_export, n_incidents=n_incidents, ndjson=ndjson)
+        info = {'incidents': n_incidents, 'batch size': batch_size}
+        self.time_stage('polrep export', 'parse',
+                        lambda: sum(len(batch) for batch in read_batches(export_file, batch_size)), **info)
+
+        def load(query):
+            with Prefetcher(None, read_batches(export_file, batch_size)) as batches:
+                for batch in batches:
+                    load_batch(query, batch)
+        self.time_stage_load('polrep export', load, CedreQuery)
+
+    def run_imports(self):
+        """Cold import time of every tool of "imports" (tool: budget in seconds, or null to only record it)."""
+        python_path = os.pathsep.join(filter(None, [ROOT_DIR, os.environ.get('PYTHONPATH')]))
+        env = dict(os.environ, PYTHONPATH=python_path)
+        for tool, budget in (self.inputs.get('imports') or {}).items():
+            timings = []
+            for _ in range(self.repeat):
+                run = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_SCRIPT, tool],
+                                     env=env, capture_output=True, text=True, check=True)
+                timings.append(float(run.stdout.split()[-1]))
+            best = min(timings)
+            within_budget = budget is None or best <= budget
+            self.results.append({'workflow': 'imports', 'stage': tool, 'best': best,
+                                 'mean': sum(timings) / len(timings), 'timings': timings, 'budget': budget,
+                                 'within budget': within_budget, 'top imports': get_top_imports(run.stderr)})
+            print(f'{"imports":<14} {tool:<12} {best:10.4f} s' + ('' if within_budget else f'  OVER BUDGET ({budget} s)'))
+
+    def is_within_budget(self):
+        return all(result.get('within budget', True) for result in self.results)
+
+    def time_stage_encoding(self, workflow, geometries):
+        self.time_stage(workflow, 'wkt', lambda: [shapely.to_wkt(geometry, rounding_precision=self.precision)
+                                                  for geometry in geometries], geometries=len(geometries))
+        self.time_stage(workflow, 'wkb', lambda: [to_wkb(geometry, self.precision) for geometry in geometries],
+                        geometries=len(geometries))
+
+    def time_stage_load(self, workflow, load, query_class=CopQuery):
+        """Time a load on a fresh query per run and record the statements the stand-in received."""
+        counts = {}
+
+        def run():
+            query, connection = self.get_query(query_class)
+            load(query)
+            self.release(query, connection)
+            if connection is not None:
+                counts.update(connection.get_counts())
+        self.time_stage(workflow, 'db load', run, database='server' if self.inputs.get('database') else 'stand-in')
+        self.results[-1].update(counts)
+
+    def load_lines(self, query, name, loc_type, lines):
+        simulation = {'name': f'BENCHMARK_{name}', 'description': 'Synthetic benchmark input'}
+        id_loc = query.set_loc_hierarchy(CAMPAIGN, MODEL, simulation, INITIAL_DATE, loc_type)
+        query.set_lines(id_loc, [(level, geometry, '') for level, geometry in lines if geometry is not None],
+                        self.precision)
+
+    def write(self, file_out):
+        report = {'date': datetime.now().isoformat(timespec='seconds'),
+                  'commit': get_commit(),
+                  'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'inputs': self.inputs,
+                  'results': self.results}
+        with open(file_out, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f'Results written to {file_out}')
+
+
+def get_top_imports(import_profile, n_top=N_TOP_IMPORTS):
+    """Packages with the most import time (seconds, submodules included) in a -X importtime profile."""
+    packages = {}
+    for line in import_profile.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0.0) + int(self_time) / 1e6
+    top = sorted(packages.items(), key=lambda item: -item[1])[:n_top]
+    return {package: round(seconds, 6) for package, seconds in top}
+
+
+def get_commit():
+    """Commit of the working tree, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(inputs):
+    benchmark = Benchmark(inputs)
+    workflows = {'mohid': benchmark.run_mohid, 'aloha': benchmark.run_aloha, 'polrep': benchmark.run_polrep,
+                 'imports': benchmark.run_imports}
+    for workflow in inputs.get('workflows', list(workflows)):
+        workflows[workflow]()
+    benchmark.write(inputs.get('output', 'results.json'))
+    if not benchmark.is_within_budget():
+        sys.exit('Cold start over budget')
+
+
+if __name__ == "__main__":
+    input_keys = ['output']
+    inputs = read_input('benchmarks.json', input_keys)
+    main(inputs)
@@ -0,0 +1,119 @@
+"""
+**standin.py**
+
+* *Purpose:* Local stand-in for the COP database, so the load stage can be timed without a server.
+  Every statement is rendered client side exactly as psycopg2 would send it (parameter
+  adaptation and quoting included) and counted, and an optional latency per round-trip
+  models the network. Inserts return fresh ids.
+
+"""
+
+import itertools
+import re
+import time
+from psycopg2.extensions import adapt
+
+# Static lookup tables (key -> uid) loaded whole by CopQuery.get_static_id
+LOOKUPS = {
+    'hns_models.loc_types': {'AEGL': 1, 'PAC': 2, 'LEL': 3, 'IDLH': 4, 'LC50': 5},
+    'hns_models.loc_levels': {name: n for n, name in enumerate(
+        ['AEGL-1', 'AEGL-2', 'AEGL-3', 'PAC-1', 'PAC-2', 'PAC-3', '10% LEL', '60% LEL', 'IDLH',
+         'AEGL-1 Confidence', 'AEGL-2 Confidence', 'AEGL-3 Confidence', 'WindConfidence LEL 10%',
+         'WindConfidence PAC-1', 'WindConfidence IDLH'], start=1)},
+    'hns_models.loc_categories': {'TOXIC': 1, 'FLAMMABLE': 2, 'ECOTOXIC': 3},
+}
+
+STATIC_QUERY = re.compile(r'^\s*SELECT\s+\w+\s*,\s*\w+\s+FROM\s+([\w.]+)\s*$', re.IGNORECASE)
+
+
+class StandInCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.result = []
+        self.rows = 0
+        self.keys = []
+
+    def mogrify(self, query, params=None):
+        """Statement with its parameters adapted and quoted, as bytes."""
+        if isinstance(query, str):
+            query = query.encode('utf-8')
+        if not params:
+            return query
+        quoted = []
+        for param in params:
+            adapted = adapt(param)
+            if hasattr(adapted, 'encoding'):
+                adapted.encoding = 'utf-8'
+            quoted.append(adapted.getquoted())
+        self.rows += 1
+        self.keys.append(params[0])
+        return query % tuple(quoted)
+
+    def execute(self, query, params=None):
+        rows, keys = self.rows, self.keys
+        statement = self.mogrify(query, params)
+        self.connection.statements += 1
+        self.connection.bytes_sent += len(statement)
+        if self.connection.latency:
+            time.sleep(self.connection.latency)
+
+        text = statement.decode('utf-8', 'replace')
+        static = STATIC_QUERY.match(text)
+        if static:
+            self.result = list(LOOKUPS.get(static.group(1), {}).items())
+        elif 'RETURNING ID, CHRONO' in text.upper():
+            # Incidents: their new id and chrono, the first value of each row
+            self.result = [(next(self.connection.ids), key) for key in keys]
+        elif 'RETURNING' in text.upper():
+            # One new id per row: the VALUES rows of execute_values, or a single row
+            n_rows = max(1, rows)
+            self.result = [(next(self.connection.ids), True) for _ in range(n_rows)]
+        else:
+            self.result = []
+        self.rows, self.keys = 0, []
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return list(self.result)
+
+    def close(self):
+        pass
+
+
+class StandInConnection:
+    """psycopg2-like connection that counts statements, bytes sent and round-trips."""
+
+    encoding = 'UTF8'
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.statements = 0
+        self.bytes_sent = 0
+        self.commits = 0
+        self.ids = itertools.count(1)
+
+    def cursor(self):
+        return StandInCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def get_counts(self):
+        return {'statements': self.statements, 'bytes sent': self.bytes_sent, 'commits': self.commits}
+
+
+def make_query(query_class, connection):
+    """
+    A CopQuery (or CedreQuery) talking to the stand-in connection instead of the pool;
+    the constructor is skipped, so no config/db.json is needed.
+    """
+    query = query_class.__new__(query_class)
+    query.con = connection
+    query.cache = {}
+    query.pool_size = 1
+    return query
@@ -11,7 +11,9 @@ Extends the base CopQuery class.
 """
 
 # Nota: Ya no necesitamos importar UUID porque pasaremos cadenas
+from psycopg2.extras import execute_values
 from common.database.cop_sql import CopQuery
+from common.metrics import metrics
 
 
 class CedreQuery(CopQuery):
@@ -19,21 +21,75 @@ class CedreQuery(CopQuery):
     Extension of CopQuery to handle insertions into the CEDRE_POLREP schema.
     """
 
-    def insert_incident(self, incident_data):
-        """
-        Inserts an incident and returns the generated ID.
-        """
-        query = """
+    INCIDENT_INSERT = """
         INSERT INTO CEDRE_POLREP.incident (
             chrono, chrono_lite, year_of_creation, number_in_year, operative_type, 
             cross_coordonnateur_id, type_rejet, toyen_alerte_poll, classification_poll, 
             qui_alerte_poll, tgi, navire_connecte, zone_geo_poll, pollution_principal, 
             reference_position
         )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326))
-        RETURNING id;
+        VALUES %s
+        RETURNING id, chrono;
+        """
+    INCIDENT_ROW = '(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326))'
+
+    # Chronos of a list already in the database
+    INCIDENT_EXISTING = """
+        SELECT chrono FROM CEDRE_POLREP.incident WHERE chrono = ANY(%s);
+        """
+
+    POLLUTION_INSERT = """
+        INSERT INTO CEDRE_POLREP.pollution (id, incident_id, gdh, type_polluant, forme, is_rectangle, longueur, superficie_pollution,
+                               taux_couverture, comentarios, has_viscosite, has_navire_connecte, erreur, source,
+                               recueil, detection_color, probability, autorite)
+        VALUES %s;
         """
+    POLLUTION_ROW = '(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
 
+    POSITION_INSERT = """
+        INSERT INTO CEDRE_POLREP.position (id, pollution_id, gdh, location, azimut, reference, distance, observation, source, empty)
+        VALUES %s;
+        """
+    POSITION_ROW = '(%s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s, %s, %s, %s, %s, %s)'
+
+    MESSAGE_INSERT = """
+        INSERT INTO CEDRE_POLREP.message (incident_id, numero_ordre, selected_mail_list, available_mail_list, type, locale, is_validate,
+                             is_sent, date_transmission, report_type, priority_level, is_warn, is_inf, is_fac,
+                             date_time_warn, date_time_inf, date_time_fac, position, outflow, position_extent,
+                             carac, wind, current, sea_state, drift, forecast, observer, action_taken, photo, organisations,
+                             spare_inf, acknowledge_warn, acknowledge_inf)
+        VALUES %s;
+        """
+    MESSAGE_ROW = '(' + ', '.join(['%s'] * 33) + ')'
+
+    BULLETIN_METEO_INSERT = """
+        INSERT INTO CEDRE_POLREP.bulletin_meteo (id, incident_id, is_pinned, position, gdh, source, type, gdh_obs, visibilite,
+                                    nebulosite, secteur_vent, force_vent, direction_vent, vitesse_vent, direction_courant,
+                                    vitesse_courant, etat_mer, temp_mer, temp_air)
+        VALUES %s;
+        """
+    BULLETIN_METEO_ROW = '(%s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, ' \
+                         '%s, %s, %s, %s)'
+
+    # Rows per multi-row INSERT statement in the bulk loader
+    PAGE_SIZE = 1000
+    # Incident documents per transaction when loading a multi-incident export
+    BATCH_SIZE = 100
+
+    def insert_incident(self, incident_data):
+        """
+        Inserts an incident and returns the generated ID.
+        """
+        cursor = self.con.cursor()
+        cursor.execute(self.INCIDENT_INSERT % self.INCIDENT_ROW, self.incident_values(incident_data))
+        incident_id = cursor.fetchone()[0]
+        self.con.commit()
+        cursor.close()
+
+        return incident_id
+
+    @staticmethod
+    def incident_values(incident_data):
         ident = incident_data.get("identification", {})
         chrono_lite = incident_data.get('chrono_lite', incident_data.get('chronoLite'))
 
@@ -45,7 +101,7 @@ class CedreQuery(CopQuery):
             lon = ref_pos["coordinates"][0]
             lat = ref_pos["coordinates"][1]
 
-        values = (
+        return (
             incident_data.get("chrono"),
             chrono_lite,
             ident.get("yearOfCreation"),
@@ -64,26 +120,15 @@ class CedreQuery(CopQuery):
             lat
         )
 
-        cursor = self.con.cursor()
-        cursor.execute(query, values)
-        incident_id = cursor.fetchone()[0]
-        self.con.commit()
-        cursor.close()
-
-        return incident_id
-
     def insert_pollution(self, pollution_data, incident_id):
-        query = """
-        INSERT INTO CEDRE_POLREP.pollution (id, incident_id, gdh, type_polluant, forme, is_rectangle, longueur, superficie_pollution,
-                               taux_couverture, comentarios, has_viscosite, has_navire_connecte, erreur, source,
-                               recueil, detection_color, probability, autorite)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-        """
+        self.insert(self.POLLUTION_INSERT % self.POLLUTION_ROW, self.pollution_values(pollution_data, incident_id))
 
+    @staticmethod
+    def pollution_values(pollution_data, incident_id):
         polluant = pollution_data.get("polluant", {})
 
         # CORRECCIÓN: Se pasa el UUID como string directo del JSON
-        values = (
+        return (
             pollution_data["uuid"],  # Antes era UUID(pollution_data["uuid"])
             incident_id,
             pollution_data["gdh"],
@@ -103,18 +148,16 @@ class CedreQuery(CopQuery):
             pollution_data.get("probability"),
             pollution_data.get("autorite")
         )
-        self.insert(query, values)
 
     def insert_position(self, position_data, pollution_id):
-        query = """
-        INSERT INTO CEDRE_POLREP.position (id, pollution_id, gdh, location, azimut, reference, distance, observation, source, empty)
-        VALUES (%s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s, %s, %s, %s, %s, %s);
-        """
+        self.insert(self.POSITION_INSERT % self.POSITION_ROW, self.position_values(position_data, pollution_id))
 
+    @staticmethod
+    def position_values(position_data, pollution_id):
         loc = position_data.get("location", {})
 
         # CORRECCIÓN: Se pasa el UUID como string directo
-        values = (
+        return (
             position_data["uuid"],  # Antes era UUID(...)
             pollution_id,
             position_data["gdh"],
@@ -127,18 +170,13 @@ class CedreQuery(CopQuery):
             position_data.get("source"),
             position_data.get("empty")
         )
-        self.insert(query, values)
 
     def insert_message(self, message_data, incident_id):
-        query = """
-        INSERT INTO CEDRE_POLREP.message (incident_id, numero_ordre, selected_mail_list, available_mail_list, type, locale, is_validate,
-                             is_sent, date_transmission, report_type, priority_level, is_warn, is_inf, is_fac,
-                             date_time_warn, date_time_inf, date_time_fac, position, outflow, position_extent,
-                             carac, wind, current, sea_state, drift, forecast, observer, action_taken, photo, organisations,
-                             spare_inf, acknowledge_warn, acknowledge_inf)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-        """
-        values = (
+        self.insert(self.MESSAGE_INSERT % self.MESSAGE_ROW, self.message_values(message_data, incident_id))
+
+    @staticmethod
+    def message_values(message_data, incident_id):
+        return (
             incident_id,
             message_data.get("numeroOrdre"),
             message_data.get("selectedMailList"),
@@ -173,20 +211,17 @@ class CedreQuery(CopQuery):
             message_data.get("acknowledgeWarn"),
             message_data.get("acknowledgeInf")
         )
-        self.insert(query, values)
 
     def insert_bulletin_meteo(self, bulletin_data, incident_id):
-        query = """
-        INSERT INTO CEDRE_POLREP.bulletin_meteo (id, incident_id, is_pinned, position, gdh, source, type, gdh_obs, visibilite,
-                                    nebulosite, secteur_vent, force_vent, direction_vent, vitesse_vent, direction_courant,
-                                    vitesse_courant, etat_mer, temp_mer, temp_air)
-        VALUES (%s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-        """
+        self.insert(self.BULLETIN_METEO_INSERT % self.BULLETIN_METEO_ROW,
+                    self.bulletin_meteo_values(bulletin_data, incident_id))
 
+    @staticmethod
+    def bulletin_meteo_values(bulletin_data, incident_id):
         pos = bulletin_data.get("position", {}).get("coordinates", [0, 0])
 
         # CORRECCIÓN: Se pasa el UUID como string directo
-        values = (
+        return (
             bulletin_data["uuid"],  # Antes era UUID(...)
             incident_id,
             bulletin_data.get("isPinned"),
@@ -208,4 +243,120 @@ class CedreQuery(CopQuery):
             bulletin_data.get("tempMer"),
             bulletin_data.get("tempAir")
         )
-        self.insert(query, values)
\ No newline at end of file
+
+    @metrics.timed('db')
+    def insert_incident_document(self, incident_data):
+        """
+        Inserts an incident document (incident, pollutions, positions, messages and meteo
+        bulletins) in a single transaction, with one multi-row INSERT per table.
+        An incident whose chrono is already in the database is skipped: returns None as its ID.
+        If anything fails the whole incident is rolled back and the error is raised.
+        Returns the incident ID and the number of rows inserted per table.
+        """
+        try:
+            cursor = self.con.cursor()
+            if not self.get_new_documents(cursor, [incident_data])[0]:
+                self.con.commit()
+                cursor.close()
+                metrics.count('db round trips')
+                return None, {}
+            cursor.execute(self.INCIDENT_INSERT % self.INCIDENT_ROW, self.incident_values(incident_data))
+            incident_id = cursor.fetchone()[0]
+
+            rows = self.document_rows(incident_data, incident_id)
+            self.insert_rows(cursor, rows)
+            self.con.commit()
+            cursor.close()
+        except Exception:
+            self.con.rollback()
+            raise
+        # The lookup, the incident, then one statement per page of rows of each table
+        metrics.count('db round trips', 2 + sum(-(-len(table_rows) // self.PAGE_SIZE) for table_rows in rows.values()))
+        metrics.count('rows inserted', 1 + sum(len(table_rows) for table_rows in rows.values()))
+        return incident_id, {table: len(table_rows) for table, table_rows in rows.items()}
+
+    @metrics.timed('db')
+    def insert_incident_batch(self, documents):
+        """
+        Inserts a batch of incident documents in a single transaction: one multi-row INSERT
+        of the incidents, then the rows of every child table of the whole batch, in FK order
+        (incident -> pollution -> position). Incidents whose chrono is already in the database,
+        or earlier in the batch, are skipped. If anything fails the batch is rolled back and
+        the error is raised; ValueError if a document has no chrono.
+        Returns the incident IDs, in the order of the documents inserted, the number of rows
+        per table and the chronos skipped.
+        """
+        if any(document.get("chrono") is None for document in documents):
+            raise ValueError('incident without chrono in the batch')
+        try:
+            cursor = self.con.cursor()
+            documents, skipped = self.get_new_documents(cursor, documents)
+            # RETURNING does not keep the order of the VALUES rows: the children find their
+            # incident through its chrono
+            incident_ids = dict((chrono, incident_id) for incident_id, chrono in execute_values(
+                cursor, self.INCIDENT_INSERT, [self.incident_values(document) for document in documents],
+                template=self.INCIDENT_ROW, page_size=self.PAGE_SIZE, fetch=True))
+
+            rows = {'pollution': [], 'position': [], 'message': [], 'bulletin_meteo': []}
+            for document in documents:
+                for table, table_rows in self.document_rows(document, incident_ids[document["chrono"]]).items():
+                    rows[table].extend(table_rows)
+            self.insert_rows(cursor, rows)
+            self.con.commit()
+            cursor.close()
+        except Exception:
+            self.con.rollback()
+            raise
+        metrics.count('db round trips', 1 + sum(-(-len(table_rows) // self.PAGE_SIZE)
+                                                for table_rows in [documents, *rows.values()]))
+        metrics.count('rows inserted', len(documents) + sum(len(table_rows) for table_rows in rows.values()))
+        return ([incident_ids[document["chrono"]] for document in documents],
+                {table: len(table_rows) for table, table_rows in rows.items()}, skipped)
+
+    def get_new_documents(self, cursor, documents):
+        """
+        Documents whose incident is neither in the database nor earlier in documents, by
+        chrono, so an export sent again, or overlapping an earlier one, adds no duplicates.
+        The incident table lock is taken first: concurrent loaders check and insert in turn,
+        until commit. Documents without chrono are kept. Does not commit.
+        Returns the new documents and the chronos skipped.
+        """
+        chronos = [document.get("chrono") for document in documents if document.get("chrono") is not None]
+        cursor.execute(f'{self.get_lock_sql("CEDRE_POLREP.incident")} {self.INCIDENT_EXISTING}', (chronos,))
+        known = {row[0] for row in cursor.fetchall()}
+        new_documents, skipped = [], []
+        for document in documents:
+            chrono = document.get("chrono")
+            if chrono in known:
+                skipped.append(chrono)
+                continue
+            if chrono is not None:
+                known.add(chrono)
+            new_documents.append(document)
+        return new_documents, skipped
+
+    def document_rows(self, incident_data, incident_id):
+        """Rows of the child tables of an incident document, per table."""
+        pollutions = incident_data.get("pollutions", [])
+        return {
+            'pollution': [self.pollution_values(pollution, incident_id) for pollution in pollutions],
+            'position': [self.position_values(position, pollution["uuid"])
+                         for pollution in pollutions for position in pollution.get("positions", [])],
+            'message': [self.message_values(message, incident_id)
+                        for message in incident_data.get("messages", [])],
+            'bulletin_meteo': [self.bulletin_meteo_values(bulletin, incident_id)
+                               for bulletin in incident_data.get("bulletinsMeteo", [])]
+        }
+
+    def insert_rows(self, cursor, rows):
+        """
+        Multi-row INSERT of the rows of every CEDRE_POLREP child table, in FK order
+        (pollution before position). Does not commit.
+        """
+        statements = {'pollution': (self.POLLUTION_INSERT, self.POLLUTION_ROW),
+                      'position': (self.POSITION_INSERT, self.POSITION_ROW),
+                      'message': (self.MESSAGE_INSERT, self.MESSAGE_ROW),
+                      'bulletin_meteo': (self.BULLETIN_METEO_INSERT, self.BULLETIN_METEO_ROW)}
+        for table, (query, template) in statements.items():
+            if rows.get(table):
+                execute_values(cursor, query, rows[table], template=template, page_size=self.PAGE_SIZE)
@@ -21,32 +21,37 @@ comticon
 """
 import os
 import sys
-import json
-from collections import OrderedDict
+import logging
 
 import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError
 from datetime import datetime
 
+from common.database.geometry import to_wkb
+from common.database.pool import DEFAULT_POOL_SIZE, read_db_config, get_connection_string, get_pool
+from common.metrics import metrics
+
+log = logging.getLogger(__name__)
+
 
 class CopQuery:
 
     def __init__(self):
         self.__connection_string = None
+        self.pool_size = DEFAULT_POOL_SIZE
         base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
         db_path = os.path.join(base_dir, 'config', 'db.json')
         self.__set_connection_string(db_path)
         self.con = None
+        # Identity cache of dimension tables: {table: {key: id}}
+        self.cache = {}
 
     def __set_connection_string(self, input_file):
         try:
-            with open(input_file, 'r') as f:
-                db_config = json.load(f, object_pairs_hook=OrderedDict)
-                self.__connection_string = 'host={0} port={1} dbname={2} user={3} password={4}'.format(
-                    db_config['host'],
-                    db_config['port'],
-                    db_config['dbname'],
-                    db_config['user'],
-                    db_config['password'])
+            db_config = read_db_config(input_file)
+            self.__connection_string = get_connection_string(db_config)
+            self.pool_size = db_config.get('pool_size', DEFAULT_POOL_SIZE)
 
         except FileNotFoundError:
             print(f'File not found: {input_file} ')
@@ -54,15 +59,44 @@ class CopQuery:
                 quit()
         
     def connect(self):
+        """Borrow a connection from the pool of this process."""
 
         try:
-            self.con = psycopg2.connect(self.__connection_string)
+            self.con = get_pool(self.__connection_string, self.pool_size).getconn()
 
         except psycopg2.OperationalError:
-            print('CAUTION: ERROR WHEN CONNECTING')
+            log.error('CAUTION: ERROR WHEN CONNECTING')
+            sys.exit()
+
+        except PoolError as e:
+            log.error('CAUTION: ERROR WHEN CONNECTING: %s', e)
             sys.exit()
 
+    def close(self):
+        """Give the connection back to the pool."""
+        if self.con is not None:
+            get_pool(self.__connection_string, self.pool_size).putconn(self.con)
+            self.con = None
+
+    def recover(self):
+        """After a failed statement: roll back its transaction, or borrow a new connection if this one was lost."""
+        if self.con is None or self.con.closed:
+            self.close()
+            self.connect()
+        else:
+            self.con.rollback()
+
+    def rollback(self):
+        """Roll back the transaction left by a failed step; a lost connection is closed, for the pool to drop it."""
+        if self.con is not None and not self.con.closed:
+            try:
+                self.con.rollback()
+            except psycopg2.Error:
+                self.con.close()
+
+    @metrics.timed('db')
     def query(self, query, params):
+        metrics.count('db round trips')
         cursor = self.con.cursor()
         cursor.execute(query, params)
         result = []
@@ -71,31 +105,111 @@ class CopQuery:
         cursor.close()
         return result
 
+    @metrics.timed('db')
     def insert(self, query, values):
+        metrics.count('db round trips')
         cursor = self.con.cursor()
         cursor.execute(query, values)
         self.con.commit()
 
+    @staticmethod
+    def get_lock_sql(*tables):
+        """
+        Statement taking the transaction advisory locks of tables, in a fixed order. Writers of
+        the same tables wait for each other until commit, so a row looked up and inserted
+        under the lock cannot be inserted twice by concurrent processes.
+        """
+        locks = ', '.join(f"pg_advisory_xact_lock(hashtext('{table}'))" for table in sorted(set(tables)))
+        return f'SELECT {locks};'
+
+    @staticmethod
+    def get_or_create_cte(name, table, keys, values=None, expressions=None):
+        """
+        WITH clauses resolving the row of `table` matching `keys` ({column: value}), inserted
+        with keys and `values` when it does not exist, as the CTE `name` (id, created).
+        `expressions` maps a column to the SQL of its value: wrapping its placeholder
+        (e.g. 'ST_GeomFromWKB(%s, 4326)'), or without placeholder, e.g. the id of an earlier
+        CTE of the same statement ('(SELECT id FROM campaign)'), in which case its value is unused.
+        Returns (sql, params).
+        """
+        values = values or {}
+        expressions = expressions or {}
+        columns = list(keys) + list(values)
+        where = ' AND '.join(f'{column} = {expressions.get(column, "%s")}' for column in keys)
+        placeholders = ', '.join(expressions.get(column, '%s') for column in columns)
+        sql = f'''{name}_existing AS (SELECT id FROM {table} WHERE {where} LIMIT 1),
+                 {name}_inserted AS (INSERT INTO {table}({', '.join(columns)})
+                                     SELECT {placeholders} WHERE NOT EXISTS (SELECT 1 FROM {name}_existing)
+                                     RETURNING id),
+                 {name} AS (SELECT id, FALSE AS created FROM {name}_existing
+                            UNION ALL SELECT id, TRUE FROM {name}_inserted)'''
+
+        def get_params(items):
+            return tuple(value for column, value in items if '%s' in expressions.get(column, '%s'))
+        params = get_params(keys.items()) + get_params(keys.items()) + get_params(values.items())
+        return sql, params
+
+    @metrics.timed('db')
+    def get_or_create(self, table, keys, values=None, expressions=None):
+        """
+        Return (id, created) of the row of `table` matching `keys` ({column: value}),
+        inserting it with keys and `values` when it does not exist (see get_or_create_cte).
+        The table lock, lookup and insert are sent together, so a single round-trip.
+        """
+        cte, params = self.get_or_create_cte('row', table, keys, values, expressions)
+        query = f'{self.get_lock_sql(table)} WITH {cte} SELECT id, created FROM row'
+        metrics.count('db round trips')
+        cursor = self.con.cursor()
+        cursor.execute(query, params)
+        row_id, created = cursor.fetchone()
+        self.con.commit()
+        cursor.close()
+        metrics.count('rows inserted', int(created))
+        return row_id, created
+
+    ''' Identity cache of dimension tables'''
+
+    def get_cached_id(self, table, key, query, params):
+        """Id of a dimension row, querying the database only the first time it is requested."""
+        table_cache = self.cache.setdefault(table, {})
+        if key not in table_cache:
+            list_tuple = self.query(query, params)
+            if not list_tuple:
+                return None
+            table_cache[key] = list_tuple[0][0]
+        return table_cache[key]
+
+    def get_static_id(self, table, key_column, id_column, key):
+        """Id from a static lookup table, which is loaded whole into the cache on first use."""
+        if table not in self.cache:
+            query = f'SELECT {key_column}, {id_column} FROM {table}'
+            self.cache[table] = dict(self.query(query, ()))
+        return self.cache[table].get(key)
+
+    def invalidate_cache(self, table=None):
+        """Drop the cached ids of one table, or of every table."""
+        if table is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(table, None)
+
     ''' Table Model'''
 
     def get_id_model(self, model):
 
         query = 'SELECT id FROM hns_models.models WHERE name = %s '
         params = (model,)
-        list_tuple = self.query(query, params)
-        if list_tuple:
-            return list_tuple[0][0]
+        return self.get_cached_id('hns_models.models', model, query, params)
 
     def set_id_model(self, name):
 
-        model_id = self.get_id_model(name)
-        if not model_id:
-            print(f'Model {name} doesn´t exist')
-            query = '''INSERT INTO hns_models.models(name) VALUES (%s) '''
-            values = (name,)
-            self.insert(query, values)
+        model_id, created = self.get_or_create('hns_models.models', {'name': name})
+        if created:
+            log.debug('Model %s doesn´t exist', name)
         else:
-            print(f'Model {name} exists with id = {model_id}')
+            log.debug('Model %s exists with id = %s', name, model_id)
+        self.cache.setdefault('hns_models.models', {})[name] = model_id
+        return model_id
 
     ''' Table campaign'''
 
@@ -103,21 +217,18 @@ class CopQuery:
 
         query = 'SELECT id FROM hns_models.campaigns WHERE name = %s '
         params = (name,)
-        list_tuple = self.query(query, params)
-
-        if list_tuple:
-            return list_tuple[0][0]
+        return self.get_cached_id('hns_models.campaigns', name, query, params)
 
     def set_id_campaign(self, name, description=''):
 
-        campaign_id = self.get_id_campaign(name)
-        if not campaign_id:
-            print('not exist')
-            query = 'INSERT INTO hns_models.campaigns(name, description) VALUES (%s, %s) '
-            values = (name, description)
-            self.insert(query, values)
+        campaign_id, created = self.get_or_create('hns_models.campaigns', {'name': name},
+                                                  {'description': description})
+        if created:
+            log.debug('Campaign %s does not exist', name)
         else:
-            print(f'Campaign {name} exists with id = {campaign_id}')
+            log.debug('Campaign %s exists with id = %s', name, campaign_id)
+        self.cache.setdefault('hns_models.campaigns', {})[name] = campaign_id
+        return campaign_id
 
     ''' Table simulation'''
 
@@ -134,18 +245,16 @@ class CopQuery:
         return self.get_id_simulation_by_ids(id_campaign, id_model, name)
 
     def set_id_simulation(self, campaign, model, name, description):
-        simulation_id = self.get_id_simulation_by_chars(campaign, model, name)
-        if not simulation_id:
-
-            print('no exist')
-            id_campaign = self.get_id_campaign(campaign)
-            id_model = self.get_id_model(model)
-            query = 'INSERT INTO hns_models.simulations(id_campaign, id_model, name, description)' \
-                    ' VALUES (%s, %s,%s, %s)'
-            values = (id_campaign, id_model, name, description)
-            self.insert(query, values)
+        id_campaign = self.get_id_campaign(campaign)
+        id_model = self.get_id_model(model)
+        simulation_id, created = self.get_or_create('hns_models.simulations',
+                                                    {'id_campaign': id_campaign, 'id_model': id_model, 'name': name},
+                                                    {'description': description})
+        if created:
+            log.debug('Simulation %s does not exist', name)
         else:
-            print(f'Simulation {name} exists with id = {simulation_id}')
+            log.debug('Simulation %s exists with id = %s', name, simulation_id)
+        return simulation_id
 
     '''Table outputs'''
 
@@ -157,37 +266,26 @@ class CopQuery:
             return list_tuple[0][0]
 
     def set_id_output(self, id_simulation, initial_date, output_type):
-        id_output = self.get_id_output(id_simulation, initial_date, output_type)
-        if not id_output:
-            print('Output does not exist')
-
-            query = 'INSERT INTO hns_models.outputs(id_simulation, initial_date, output_type)' \
-                    ' VALUES (%s, %s,%s)'
-            values = (id_simulation, initial_date, output_type)
-            print(values)
-            self.insert(query, values)
+        id_output, created = self.get_or_create('hns_models.outputs',
+                                                {'id_simulation': id_simulation, 'initial_date': initial_date,
+                                                 'output_type': output_type})
+        if created:
+            log.debug('Output does not exist: %s', (id_simulation, initial_date, output_type))
         else:
-            print(f'Output exists with id = {id_output}')
+            log.debug('Output exists with id = %s', id_output)
+        return id_output
 
     def get_uid_loc_categories(self, category):
-        query = 'SELECT uid FROM hns_models.loc_categories WHERE name = %s'
-        params = (category,)
-        list_tuple = self.query(query, params)
-        if list_tuple:
-            return list_tuple[0][0]
+        return self.get_static_id('hns_models.loc_categories', 'name', 'uid', category)
 
     def get_uid_loc_type(self, loc_type):
-        query = 'SELECT uid FROM hns_models.loc_types WHERE type = %s'
-        params = (loc_type,)
-        list_tuple = self.query(query, params)
-        if list_tuple:
-            return list_tuple[0][0]
+        return self.get_static_id('hns_models.loc_types', 'type', 'uid', loc_type)
 
     def get_loc_id(self, id_output, id_type):
         query = 'SELECT id FROM hns_models.loc WHERE id_output = %s AND id_type = %s'
         params = (id_output, id_type,)
         list_tuple = self.query(query, params)
-        print('id_locs:      ', params, list_tuple)
+        log.debug('id_locs: %s %s', params, list_tuple)
         if list_tuple:
             return list_tuple[0][0]
 
@@ -196,24 +294,16 @@ class CopQuery:
         return self. get_loc_id(id_output, id_type)
 
     def set_id_loc(self, id_output,  loc_type):
-        id_loc = self.get_loc_id_by_type(id_output, loc_type)
-        if not id_loc:
-            print('LOC does not exist')
-            id_type = self.get_uid_loc_type(loc_type)
-            query = 'INSERT INTO hns_models.loc(id_output, id_type)' \
-                    ' VALUES (%s, %s)'
-            values = (id_output,  id_type)
-            print(values)
-            self.insert(query, values)
+        id_type = self.get_uid_loc_type(loc_type)
+        id_loc, created = self.get_or_create('hns_models.loc', {'id_output': id_output, 'id_type': id_type})
+        if created:
+            log.debug('LOC does not exist: %s', (id_output, id_type))
         else:
-            print(f'LOC exists with id = {id_loc}')
+            log.debug('LOC exists with id = %s', id_loc)
+        return id_loc
 
     def get_uid_loc_level(self, level_name):
-        query = 'SELECT uid FROM hns_models.loc_levels WHERE level_name = %s'
-        params = (level_name,)
-        list_tuple = self.query(query, params)
-        if list_tuple:
-            return list_tuple[0][0]
+        return self.get_static_id('hns_models.loc_levels', 'level_name', 'uid', level_name)
 
     def get_id_line(self, id_loc, id_loc_level):
         query = 'SELECT id FROM hns_models.lines WHERE id_loc = %s AND id_loc_level = %s'
@@ -227,21 +317,108 @@ class CopQuery:
 
         return self.get_id_line(id_loc, id_loc_level)
 
-    def set_line(self, id_loc, level_name, envelope, description=''):
-
-        id_line = self.get_id_line_by_loc_level(id_loc, level_name)
-
-        if not id_line:
+    def set_line(self, id_loc, level_name, envelope, description='', precision=None):
+        """
+        Insert a LOC line. The envelope (Shapely geometry, WKT or WKB) is sent as WKB,
+        with coordinates rounded to `precision` decimals if given.
+        """
 
+        id_loc_level = self.get_uid_loc_level(level_name)
+        id_line, created = self.get_or_create('hns_models.lines', {'id_loc': id_loc, 'id_loc_level': id_loc_level},
+                                              {'envelope': psycopg2.Binary(to_wkb(envelope, precision)),
+                                               'description': description},
+                                              {'envelope': 'ST_GeomFromWKB(%s, 4326)'})
+        if not created:
+            log.debug('Line of %s exists in LOC %s', level_name, id_loc)
+        return id_line
+
+    def upsert_line(self, id_loc, level_name, envelope, description='', precision=None):
+        """
+        Insert a LOC line, or replace the envelope and description of the existing one,
+        in a single statement.
+        """
+        id_loc_level = self.get_uid_loc_level(level_name)
+        wkb = psycopg2.Binary(to_wkb(envelope, precision))
+        query = '''WITH updated AS (UPDATE hns_models.lines SET envelope = ST_GeomFromWKB(%s, 4326), description = %s
+                                    WHERE id_loc = %s AND id_loc_level = %s RETURNING id)
+                   INSERT INTO hns_models.lines(id_loc, id_loc_level, envelope, description)
+                   SELECT %s, %s, ST_GeomFromWKB(%s, 4326), %s WHERE NOT EXISTS (SELECT 1 FROM updated)'''
+        values = (wkb, description, id_loc, id_loc_level, id_loc, id_loc_level, wkb, description)
+        self.insert(f'{self.get_lock_sql("hns_models.lines")} {query}', values)
+
+    def set_lines(self, id_loc, lines, precision=None):
+        """
+        Insert the missing LOC lines of id_loc with a single multi-row INSERT.
+        lines is a list of (level_name, envelope, description); when a level is
+        repeated only its first line is kept. Returns the number of lines inserted.
+        """
+        rows, level_ids = [], set()
+        for level_name, envelope, description in lines:
             id_loc_level = self.get_uid_loc_level(level_name)
-            query = 'INSERT INTO hns_models.lines(id_loc, id_loc_level, envelope, description)' \
-                    ' VALUES (%s, %s, ST_GeomFromText(%s, 4326), %s)'
-            values = (id_loc, id_loc_level, str(envelope), description)
-            self.insert(query, values)
-        else:
-            print(f'LOC exists with id = {id_loc}')
-
-
+            if id_loc_level in level_ids:
+                continue
+            level_ids.add(id_loc_level)
+            rows.append((id_loc, id_loc_level, psycopg2.Binary(to_wkb(envelope, precision)), description))
+        if not rows:
+            return 0
+
+        query = self.get_lock_sql('hns_models.lines') + '''
+                   INSERT INTO hns_models.lines(id_loc, id_loc_level, envelope, description)
+                   SELECT v.id_loc, v.id_loc_level, ST_GeomFromWKB(v.envelope, 4326), v.description
+                   FROM (VALUES %s) AS v(id_loc, id_loc_level, envelope, description)
+                   WHERE NOT EXISTS (SELECT 1 FROM hns_models.lines l
+                                     WHERE l.id_loc = v.id_loc AND l.id_loc_level = v.id_loc_level)
+                   RETURNING id'''
+        with metrics.stage('db'):
+            metrics.count('db round trips')
+            cursor = self.con.cursor()
+            inserted = execute_values(cursor, query, rows, fetch=True)
+            self.con.commit()
+            cursor.close()
+        metrics.count('rows inserted', len(inserted))
+        return len(inserted)
+
+    def set_loc_hierarchy(self, campaign, model, simulation, initial_date, loc_type, output_type='LOC AREAS'):
+        """
+        Resolve (creating what is missing) campaign -> model -> simulation -> output -> LOC
+        and return the LOC id. campaign and simulation are dicts with name and description.
+        """
+        return self.set_simulation_loc(campaign, model, simulation, initial_date, loc_type, output_type)[1]
+
+    @metrics.timed('db')
+    def set_simulation_loc(self, campaign, model, simulation, initial_date, loc_type, output_type='LOC AREAS'):
+        """
+        As set_loc_hierarchy, returning (id_simulation, id_loc). The five levels are resolved
+        by a single statement of chained CTEs under the locks of their tables, and one commit.
+        """
+        id_type = self.get_uid_loc_type(loc_type)
+        ctes = [self.get_or_create_cte('campaign', 'hns_models.campaigns', {'name': campaign['name']},
+                                       {'description': campaign['description']}),
+                self.get_or_create_cte('model', 'hns_models.models', {'name': model}),
+                self.get_or_create_cte('simulation', 'hns_models.simulations',
+                                       {'id_campaign': None, 'id_model': None, 'name': simulation['name']},
+                                       {'description': simulation['description']},
+                                       {'id_campaign': '(SELECT id FROM campaign)',
+                                        'id_model': '(SELECT id FROM model)'}),
+                self.get_or_create_cte('output', 'hns_models.outputs',
+                                       {'id_simulation': None, 'initial_date': initial_date,
+                                        'output_type': output_type},
+                                       expressions={'id_simulation': '(SELECT id FROM simulation)'}),
+                self.get_or_create_cte('loc', 'hns_models.loc', {'id_output': None, 'id_type': id_type},
+                                       expressions={'id_output': '(SELECT id FROM output)'})]
+        lock = self.get_lock_sql('hns_models.campaigns', 'hns_models.models', 'hns_models.simulations',
+                                 'hns_models.outputs', 'hns_models.loc')
+        query = f"{lock} WITH {', '.join(sql for sql, _ in ctes)} " \
+                f"SELECT (SELECT id FROM loc), (SELECT id FROM simulation)"
+        params = tuple(param for _, cte_params in ctes for param in cte_params)
+        metrics.count('db round trips')
+        cursor = self.con.cursor()
+        cursor.execute(query, params)
+        id_loc, id_simulation = cursor.fetchone()
+        self.con.commit()
+        cursor.close()
+        log.debug('Simulation %s -> LOC %s', id_simulation, id_loc)
+        return id_simulation, id_loc
 
 def main():
 
@@ -264,7 +441,7 @@ def main():
     id_loc = 1
     #aloha.set_line(id_loc, loc_level_name, geometry, description)
 
-    aloha.con.close()
+    aloha.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+geometry.py
+
+@Purpose: Encoding of geometries sent to the COP database.
+Geometries travel as WKB (binary) instead of WKT text, optionally quantized
+to a fixed number of decimals.
+Shapely and numpy are imported on first use, so tools that load no geometry
+(CEDRE POLREP) do not pay for them at start-up.
+
+@version: 1.0.0
+@date 2026-02-17
+"""
+
+from common.metrics import metrics
+
+
+def to_geometry(envelope):
+    """Return a Shapely geometry from a Shapely object, a WKT string or WKB bytes."""
+    import shapely
+    if isinstance(envelope, str):
+        return shapely.from_wkt(envelope)
+    if isinstance(envelope, (bytes, bytearray, memoryview)):
+        return shapely.from_wkb(bytes(envelope))
+    return envelope
+
+
+def quantize(geometry, precision):
+    """Round every coordinate of a geometry to `precision` decimals."""
+    import numpy as np
+    import shapely
+    return shapely.transform(geometry, lambda coordinates: np.round(coordinates, precision))
+
+
+def to_wkb(envelope, precision=None):
+    """
+    WKB bytes of a geometry (Shapely object, WKT string or WKB bytes).
+    If precision is given, coordinates are rounded to that number of decimals first.
+    """
+    if isinstance(envelope, (bytes, bytearray, memoryview)) and precision is None:
+        return bytes(envelope)
+    import shapely
+    with metrics.stage('encode'):
+        geometry = to_geometry(envelope)
+        if precision is not None:
+            geometry = quantize(geometry, precision)
+        wkb = shapely.to_wkb(geometry)
+    metrics.count('vertices', int(shapely.get_num_coordinates(geometry)))
+    metrics.count('wkb bytes', len(wkb))
+    return wkb
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+manifest.py
+
+@Purpose: Ingestion manifest, a local SQLite record of every input already loaded into
+the COP database. An input is identified by the SHA-256 of its content, the tool and
+the hash of the configuration it was ingested with, so a sweep over a drop folder can
+skip unchanged inputs before reading them. Content hashes are cached by (path, size,
+mtime), so an unchanged file costs a stat and two indexed lookups.
+An ingestion first claims its input (status 'running') and marks it 'done' once loaded,
+so concurrent sweeps sharing the manifest never ingest the same input twice.
+
+@version: 1.0.0
+@date 2026-02-17
+"""
+
+import os
+import json
+import socket
+import sqlite3
+import hashlib
+import logging
+from datetime import datetime, timezone
+from common.readers.inout import file_sha256
+
+log = logging.getLogger(__name__)
+
+# Configuration keys that do not change what is ingested, left out of the config hash
+IGNORED_KEYS = ('file_in', 'manifest', 'log level', 'metrics', 'processes')
+
+# Claims older than this (seconds) are taken over: their ingestion is presumed dead
+CLAIM_TIMEOUT = 24 * 3600
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS content_hashes (
+    path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, sha256 TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS ingestions (
+    sha256 TEXT NOT NULL, tool TEXT NOT NULL, config_hash TEXT NOT NULL,
+    file TEXT NOT NULL, ids TEXT, ingested TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'done', owner TEXT,
+    PRIMARY KEY (sha256, tool, config_hash));
+'''
+
+
+def get_config_hash(config):
+    """SHA-256 of the configuration of an ingestion, without the keys that do not change its result."""
+    config = {key: value for key, value in (config or {}).items() if key not in IGNORED_KEYS}
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_owner():
+    """Host and process of a claim."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def is_process_alive(owner):
+    """Whether the process of a claim may still be running: always, for another host."""
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+class IngestionManifest:
+    """Inputs already ingested, or being ingested, per tool and configuration, in a SQLite file."""
+
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        directory = os.path.dirname(os.path.abspath(manifest_file))
+        os.makedirs(directory, exist_ok=True)
+        # Several sweeps may share the manifest: wait for the lock instead of failing.
+        # Transactions are explicit (BEGIN IMMEDIATE to claim an input)
+        self.con = sqlite3.connect(manifest_file, timeout=60, isolation_level=None)
+        self.con.executescript(SCHEMA)
+        columns = [row[1] for row in self.con.execute('PRAGMA table_info(ingestions)')]
+        if 'status' not in columns:
+            # Manifest written before claims: every record is a finished ingestion
+            self.con.executescript("ALTER TABLE ingestions ADD COLUMN status TEXT NOT NULL DEFAULT 'done';"
+                                   "ALTER TABLE ingestions ADD COLUMN owner TEXT;")
+        # Inputs claimed and not recorded yet: (path, tool, config hash) -> sha256 claimed
+        self.claims = {}
+
+    def close(self):
+        """Release the claims not recorded (their ingestion failed) and close the manifest."""
+        for path, tool, config_hash in list(self.claims):
+            self.release_key(path, tool, config_hash)
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_content_hash(self, file_in):
+        """SHA-256 of a file, hashed again only when its size or mtime changed."""
+        path = os.path.abspath(file_in)
+        stat = os.stat(path)
+        row = self.con.execute('SELECT size, mtime_ns, sha256 FROM content_hashes WHERE path = ?', (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        sha256 = file_sha256(path)
+        self.con.execute('INSERT OR REPLACE INTO content_hashes VALUES (?, ?, ?, ?)',
+                         (path, stat.st_size, stat.st_mtime_ns, sha256))
+        return sha256
+
+    def get_ingestion(self, file_in, tool, config=None):
+        """Record (file, ids, ingested) of an earlier ingestion of the same content and config, or None."""
+        row = self.con.execute("SELECT file, ids, ingested FROM ingestions "
+                               "WHERE sha256 = ? AND tool = ? AND config_hash = ? AND status = 'done'",
+                               (self.get_content_hash(file_in), tool, get_config_hash(config))).fetchone()
+        if row is None:
+            return None
+        return {'file': row[0], 'ids': json.loads(row[1]) if row[1] else None, 'ingested': row[2]}
+
+    def is_ingested(self, file_in, tool, config=None) -> bool:
+        ingestion = self.get_ingestion(file_in, tool, config)
+        if ingestion is not None:
+            log.info('%s already ingested by %s on %s (ids %s), skipped',
+                     file_in, tool, ingestion["ingested"], ingestion["ids"])
+        return ingestion is not None
+
+    def claim(self, file_in, tool, config=None) -> bool:
+        """
+        Claim an input before ingesting it. False if it was already ingested with the same
+        content and config, or is being ingested by another live process (claims older than
+        CLAIM_TIMEOUT, or of a dead process of this host, are taken over).
+        The lookup and the claim are one write transaction, so two sweeps cannot both claim it.
+        """
+        sha256, config_hash = self.get_content_hash(file_in), get_config_hash(config)
+        self.con.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.con.execute('SELECT status, owner, ingested, ids FROM ingestions '
+                                   'WHERE sha256 = ? AND tool = ? AND config_hash = ?',
+                                   (sha256, tool, config_hash)).fetchone()
+            if row is not None and row[0] == 'done':
+                log.info('%s already ingested by %s on %s (ids %s), skipped', file_in, tool, row[2], row[3])
+                self.con.execute('ROLLBACK')
+                return False
+            if row is not None:
+                age = (datetime.now(timezone.utc) - datetime.fromisoformat(row[2])).total_seconds()
+                if age < CLAIM_TIMEOUT and is_process_alive(row[1]):
+                    log.info('%s is being ingested by %s since %s (%s), skipped', file_in, tool, row[2], row[1])
+                    self.con.execute('ROLLBACK')
+                    return False
+                log.warning('CAUTION: claim of %s by %s since %s is stale, taken over', file_in, row[1], row[2])
+            self.con.execute("INSERT OR REPLACE INTO ingestions VALUES (?, ?, ?, ?, NULL, ?, 'running', ?)",
+                             (sha256, tool, config_hash, os.path.abspath(file_in), now(), get_owner()))
+            self.con.execute('COMMIT')
+        except BaseException:
+            self.con.execute('ROLLBACK')
+            raise
+        self.claims[(os.path.abspath(file_in), tool, config_hash)] = sha256
+        return True
+
+    def record(self, file_in, tool, config=None, ids=None):
+        """Record a successful ingestion with the ids it produced (under the content hash claimed, if any)."""
+        path, config_hash = os.path.abspath(file_in), get_config_hash(config)
+        sha256 = self.claims.pop((path, tool, config_hash), None) or self.get_content_hash(file_in)
+        self.con.execute("INSERT OR REPLACE INTO ingestions VALUES (?, ?, ?, ?, ?, ?, 'done', ?)",
+                         (sha256, tool, config_hash, path, json.dumps(ids, default=str), now(), get_owner()))
+
+    def release(self, file_in, tool, config=None):
+        """Give up the claim of an input that could not be ingested, so a later sweep retries it."""
+        self.release_key(os.path.abspath(file_in), tool, get_config_hash(config))
+
+    def release_key(self, path, tool, config_hash):
+        sha256 = self.claims.pop((path, tool, config_hash), None)
+        if sha256 is not None:
+            self.con.execute("DELETE FROM ingestions WHERE sha256 = ? AND tool = ? AND config_hash = ? "
+                             "AND status = 'running' AND owner = ?", (sha256, tool, config_hash, get_owner()))
+
+
+def ingest_once(manifest_file, file_in, tool, config, ingest):
+    """
+    Run ingest() for file_in unless the manifest (if any) has it ingested or being ingested.
+    ingest returns the ids to record, or None when the input must not be recorded
+    (nothing loaded, or loaded in part): its claim is then released.
+    Returns the ids of the ingestion, None if it was skipped or loaded nothing.
+    """
+    if not manifest_file:
+        return ingest()
+    with IngestionManifest(manifest_file) as manifest:
+        if not manifest.claim(file_in, tool, config):
+            return None
+        ids = ingest()
+        if ids is not None:
+            manifest.record(file_in, tool, config, ids)
+        return ids
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+pool.py
+
+@Purpose: Pooled connections to the COP database.
+Every CopQuery of a process borrows its connection from a shared, thread-safe
+pool, so batch runs reuse warm connections instead of paying the TLS and
+authentication handshake for each file. A forked process builds its own pool.
+
+@version: 1.0.0
+@date 2026-02-17
+"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2 import pool as pg_pool
+
+# Maximum number of connections of a pool, unless db.json sets "pool_size"
+DEFAULT_POOL_SIZE = 4
+# Connections idle for longer than this (seconds) are pinged before being lent
+HEALTH_CHECK_INTERVAL = 30
+# Seconds getconn waits for a connection while all of them are lent
+CONNECT_TIMEOUT = 60
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def read_db_config(input_file):
+    """Database settings of a db.json file, read once per process."""
+    with open(input_file, 'r') as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+def get_connection_string(db_config):
+    return 'host={0} port={1} dbname={2} user={3} password={4}'.format(
+        db_config['host'],
+        db_config['port'],
+        db_config['dbname'],
+        db_config['user'],
+        db_config['password'])
+
+
+class ConnectionPool:
+    """Thread-safe pool of connections with a health check when a connection is lent."""
+
+    def __init__(self, connection_string, pool_size=DEFAULT_POOL_SIZE, health_check_interval=HEALTH_CHECK_INTERVAL):
+        self.pool = pg_pool.ThreadedConnectionPool(1, pool_size, connection_string)
+        self.pool_size = pool_size
+        self.health_check_interval = health_check_interval
+        self.returned_at = {}
+        # One slot per connection: borrowers wait for a free one instead of exhausting the pool
+        self.slots = threading.BoundedSemaphore(pool_size)
+        self.n_lent = 0
+
+    def getconn(self, timeout=CONNECT_TIMEOUT):
+        """
+        Lend a healthy connection, waiting up to timeout seconds while all of them are lent
+        (PoolError after). A broken connection is closed and replaced, and the replacement
+        checked too, up to pool_size attempts (OperationalError after).
+        """
+        if not self.slots.acquire(timeout=timeout):
+            raise pg_pool.PoolError(f'connection pool exhausted: no connection free after {timeout} s')
+        try:
+            for _ in range(self.pool_size):
+                con = self.pool.getconn()
+                if self.is_healthy(con):
+                    with _pools_lock:
+                        self.n_lent += 1
+                    return con
+                self.returned_at.pop(id(con), None)
+                self.pool.putconn(con, close=True)
+            raise psycopg2.OperationalError(f'no healthy connection after {self.pool_size} attempts')
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, con):
+        with _pools_lock:
+            self.n_lent -= 1
+        try:
+            if not con.closed and con.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    con.rollback()
+                except psycopg2.Error:
+                    con.close()
+            if con.closed:
+                self.returned_at.pop(id(con), None)
+                self.pool.putconn(con, close=True)
+                return
+            self.returned_at[id(con)] = time.monotonic()
+            self.pool.putconn(con)
+        finally:
+            self.slots.release()
+
+    def is_healthy(self, con):
+        """A connection is healthy if it is open and, after a long idle time, answers a ping."""
+        if con.closed or con.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        idle = time.monotonic() - self.returned_at.get(id(con), time.monotonic())
+        if idle < self.health_check_interval:
+            return True
+        try:
+            cursor = con.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            con.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def closeall(self):
+        self.pool.closeall()
+
+
+def get_pool(connection_string, pool_size=DEFAULT_POOL_SIZE):
+    """Pool of the current process for a connection string, created on first use."""
+    key = (os.getpid(), connection_string)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(connection_string, pool_size)
+        return _pools[key]
+
+
+def get_lent_connections():
+    """Connections of the pools of the current process lent and not given back yet."""
+    with _pools_lock:
+        return sum(pool.n_lent for key, pool in _pools.items() if key[0] == os.getpid())
+
+
+def close_pools():
+    """Close every connection of the pools of the current process."""
+    with _pools_lock:
+        for key in [key for key in _pools if key[0] == os.getpid()]:
+            _pools.pop(key).closeall()
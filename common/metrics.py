@@ -0,0 +1,171 @@
+"""
+**metrics.py**
+
+* *Purpose:* Instrumentation shared by the ETL tools: stage timers and counters of a run,
+  exported as a JSON run report and as a Prometheus textfile (node_exporter textfile collector),
+  and the logging setup that keeps diagnostic output behind log levels.
+
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+
+log = logging.getLogger(__name__)
+
+PROMETHEUS_PREFIX = 'coptool'
+
+
+def setup_logging(level='INFO'):
+    """Log to stderr, messages only, at the given level (name or number)."""
+    if isinstance(level, str):
+        level = getattr(logging, level.upper())
+    logging.basicConfig(format='%(message)s')
+    logging.getLogger().setLevel(level)
+
+
+class Metrics:
+    """
+    Stage timers and counters of one run of a tool.
+    Stages are timed with `with metrics.stage('read'):` (or the timed decorator) and add up
+    over calls; stages may overlap, e.g. reads in the prefetch thread during a reduction.
+    Counters (rows, bytes, vertices, round-trips...) are added with count. Thread safe.
+    """
+
+    def __init__(self, tool=None):
+        self.lock = threading.Lock()
+        self.reset(tool)
+
+    def reset(self, tool=None):
+        """Start a new run."""
+        with self.lock:
+            self.tool = tool
+            self.started = time.time()
+            self.stages = {}
+            self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """Decorator timing every call of a function as the stage `name`."""
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def take(self):
+        """
+        Stages and counters recorded since the last take (or reset), which are cleared:
+        what a worker process sends back with its result, for its parent to merge.
+        """
+        with self.lock:
+            recorded = {'stages': self.stages, 'counters': self.counters}
+            self.stages, self.counters = {}, {}
+        return recorded
+
+    def merge(self, recorded):
+        """Add the stages and counters taken in a worker process (see take)."""
+        with self.lock:
+            for name, worker_stage in recorded['stages'].items():
+                stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+                stage['seconds'] += worker_stage['seconds']
+                stage['calls'] += worker_stage['calls']
+            for name, value in recorded['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_report(self):
+        with self.lock:
+            return {'tool': self.tool,
+                    'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec='seconds'),
+                    'elapsed': time.time() - self.started,
+                    'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                    'counters': dict(self.counters)}
+
+    def write_json(self, file_out):
+        write_atomic(file_out, json.dumps(self.get_report(), indent=4))
+
+    def write_prometheus(self, file_out):
+        """
+        Prometheus text format, one gauge per stage and counter holding the values of the last run.
+        Written to a temporary file and renamed, as the textfile collector expects.
+        """
+        report = self.get_report()
+        tool = f'tool="{report["tool"]}"'
+        lines = [f'# HELP {PROMETHEUS_PREFIX}_stage_seconds Time spent in each stage of the last run.',
+                 f'# TYPE {PROMETHEUS_PREFIX}_stage_seconds gauge']
+        lines += [f'{PROMETHEUS_PREFIX}_stage_seconds{{{tool},stage="{name}"}} {stage["seconds"]:.6f}'
+                  for name, stage in report['stages'].items()]
+        lines += [f'# HELP {PROMETHEUS_PREFIX}_stage_calls Calls of each stage in the last run.',
+                  f'# TYPE {PROMETHEUS_PREFIX}_stage_calls gauge']
+        lines += [f'{PROMETHEUS_PREFIX}_stage_calls{{{tool},stage="{name}"}} {stage["calls"]}'
+                  for name, stage in report['stages'].items()]
+        for name, value in report['counters'].items():
+            metric = f'{PROMETHEUS_PREFIX}_{get_metric_name(name)}'
+            lines += [f'# TYPE {metric} gauge', f'{metric}{{{tool}}} {value}']
+        lines += [f'# TYPE {PROMETHEUS_PREFIX}_run_elapsed_seconds gauge',
+                  f'{PROMETHEUS_PREFIX}_run_elapsed_seconds{{{tool}}} {report["elapsed"]:.6f}',
+                  f'# TYPE {PROMETHEUS_PREFIX}_run_timestamp_seconds gauge',
+                  f'{PROMETHEUS_PREFIX}_run_timestamp_seconds{{{tool}}} {self.started:.0f}']
+        write_atomic(file_out, '\n'.join(lines) + '\n')
+
+    def export(self, outputs=None):
+        """Log the stage summary and write the reports named in outputs ({"json": path, "prometheus": path})."""
+        report = self.get_report()
+        for name, stage in sorted(report['stages'].items(), key=lambda item: -item[1]['seconds']):
+            log.info('  %-10s %9.3f s  (%s calls)', name, stage["seconds"], stage["calls"])
+        for name, value in report['counters'].items():
+            log.info('  %-20s %s', name, value)
+        outputs = outputs or {}
+        if outputs.get('json'):
+            self.write_json(outputs['json'])
+        if outputs.get('prometheus'):
+            self.write_prometheus(outputs['prometheus'])
+
+
+def get_metric_name(name):
+    """Prometheus metric name of a counter: lower case, words joined by underscores."""
+    return re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+
+
+def write_atomic(file_out, text):
+    directory = os.path.dirname(os.path.abspath(file_out))
+    os.makedirs(directory, exist_ok=True)
+    temporary = f'{file_out}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as f:
+        f.write(text)
+    os.replace(temporary, file_out)
+
+
+# Metrics of the current run of this process
+metrics = Metrics()
+
+
+def init_worker():
+    """Process pool initializer: a forked worker starts from a copy of its parent's metrics, drop them."""
+    metrics.reset(metrics.tool)
+
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+**field_cache.py**
+
+* *Purpose:* Persistent on-disk cache of reduced fields (e.g. the time maximum of a
+  MOHID variable). Entries are content-addressed by the input file (size and mtime,
+  or optionally its SHA-256), the variable, the reduction and the subset, and are
+  stored as memory-mappable .npy sidecars with size-bounded LRU eviction.
+  ReductionState keeps the running reduction of a file that is still being written.
+
+* *python version:* 3.9
+* *author:* Pedro Montero
+* *license:* INTECMAR
+* *requires:* numpy
+* *date:* 2026/02/17
+* *version:* 1.0.0
+* *date version* 2026/02/17
+
+
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from common.readers.inout import file_sha256
+
+# Default size limit of a cache directory (bytes)
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+# Sidecar files of every entry
+PARTS = ('field', 'latitudes', 'longitudes')
+
+
+class FieldCache:
+    """ Size-bounded LRU cache of reduced fields in a directory"""
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, hash_content=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, file_in, variable, reduction, **subset) -> str:
+        """ Key of a reduced field: input file identity, variable, reduction and subset"""
+        stat = os.stat(file_in)
+        identity = {'file': os.path.abspath(file_in), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                    'variable': variable, 'reduction': reduction, 'subset': subset}
+        if self.hash_content:
+            identity = {'sha256': file_sha256(file_in), 'variable': variable, 'reduction': reduction,
+                        'subset': subset}
+        return hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get_path(self, key, part):
+        return os.path.join(self.cache_dir, f'{key}_{part}.npy')
+
+    def load(self, key):
+        """ (field, latitudes, longitudes) memory-mapped from the cache, or None on a miss"""
+        paths = [self.get_path(key, part) for part in PARTS]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        for path in paths:
+            os.utime(path)  # Mark as recently used
+        return tuple(np.load(path, mmap_mode='r') for path in paths)
+
+    def store(self, key, field, latitudes, longitudes):
+        """ Save an entry (masked cells are stored as NaN) and evict the least recently used ones"""
+        for part, array in zip(PARTS, (field, latitudes, longitudes)):
+            if np.ma.isMaskedArray(array):
+                if not np.issubdtype(array.dtype, np.floating):
+                    array = array.astype(float)
+                array = np.ma.filled(array, np.nan)
+            path = self.get_path(key, part)
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, np.asarray(array))
+            os.replace(path + '.tmp', path)
+        self.evict()
+
+    def evict(self):
+        """ Remove least recently used entries until the cache fits in max_bytes"""
+        entries = {}
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npy'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            stat = os.stat(path)
+            key = name.rsplit('_', 1)[0]
+            size, used = entries.get(key, (0, 0))
+            entries[key] = (size + stat.st_size, max(used, stat.st_mtime))
+
+        total = sum(size for size, used in entries.values())
+        for key, (size, used) in sorted(entries.items(), key=lambda entry: entry[1][1]):
+            if total <= self.max_bytes:
+                break
+            for part in PARTS:
+                path = self.get_path(key, part)
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
+
+
+class ReductionState:
+    """ Running reduction of a file that is still being written: the reduced field, the key
+    of the last timestep folded into it and the origin of the time axis it was read from"""
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(file_in, variable, reduction, **subset) -> str:
+        """ Key of a running reduction; unlike FieldCache it ignores size and mtime, which change as the file grows"""
+        identity = {'file': os.path.abspath(file_in), 'variable': variable, 'reduction': reduction, 'subset': subset}
+        return hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode()).hexdigest()
+
+    @staticmethod
+    def get_origin(first_time_key, first_date) -> dict:
+        """ Origin of a time axis: a file rewritten in place (e.g. a new forecast) starts at another one"""
+        return {'first_time_key': int(first_time_key), 'first_date': str(first_date)}
+
+    def get_paths(self, key):
+        return os.path.join(self.state_dir, f'{key}.npy'), os.path.join(self.state_dir, f'{key}.json')
+
+    def load(self, key):
+        """ (field, last timestep key, origin) of a running reduction, or (None, None, None) if there is none"""
+        field_path, meta_path = self.get_paths(key)
+        if not (os.path.exists(field_path) and os.path.exists(meta_path)):
+            return None, None, None
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        return np.load(field_path), meta['last_time_key'], meta.get('origin')
+
+    def store(self, key, field, last_time_key, origin):
+        field_path, meta_path = self.get_paths(key)
+        if np.ma.isMaskedArray(field):
+            field = np.ma.filled(field.astype(float), np.nan)
+        with open(field_path + '.tmp', 'wb') as f:
+            np.save(f, np.asarray(field))
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'last_time_key': int(last_time_key), 'origin': origin}, f)
+        os.replace(field_path + '.tmp', field_path)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def reset(self, key):
+        for path in self.get_paths(key):
+            if os.path.exists(path):
+                os.remove(path)
@@ -1,7 +1,17 @@
 import json
+import hashlib
 from collections import OrderedDict
 
 
+def file_sha256(file_in, chunk_size=1024 ** 2):
+    """ SHA-256 of the content of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_in, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def read_input(input_file, input_keys):
     try:
         with open(input_file, 'r') as f:
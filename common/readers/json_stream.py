@@ -0,0 +1,95 @@
+"""
+**json_stream.py**
+
+* *Purpose:* Stream the documents of a JSON export one at a time, with memory bounded by the
+  largest document plus one chunk: a single object, a JSON array of objects, or NDJSON
+  (one object per line, or any whitespace separated sequence of objects).
+
+"""
+
+import json
+
+# Characters read from the file at a time
+DEFAULT_CHUNK_SIZE = 1024 ** 2
+
+WHITESPACE = ' \t\n\r'
+# Characters that can go on a number: a number followed only by them may be cut by the chunk
+NUMBER_CHARACTERS = '0123456789.eE+-'
+
+
+class JSONStream:
+    """Buffered reader decoding consecutive JSON values of a text file."""
+
+    def __init__(self, f, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+
+    def read_more(self, size):
+        """Append up to size characters to the buffer, dropping what was consumed. False at the end of the file."""
+        chunk = self.f.read(size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character, without consuming it ('' at the end of the file)."""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read_more(self.chunk_size):
+                return ''
+
+    def skip(self):
+        self.position += 1
+
+    def decode(self):
+        """Decode the next value, reading on until it is complete."""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self.read_more(size):
+                    raise
+                # Grow the reads, so a large document is decoded again only a few times
+                size *= 2
+                continue
+            # A number at the end of the buffer may go on in the next chunk: decode it again with more text
+            if is_number(value) and not self.buffer[end:].strip(NUMBER_CHARACTERS) and self.read_more(size):
+                continue
+            self.position = end
+            return value
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def iter_json_documents(file_in, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the documents of a JSON file: its elements if it holds an array, else each top-level value."""
+    with open(file_in, 'r', encoding='utf-8-sig') as f:
+        stream = JSONStream(f, chunk_size)
+        if stream.peek() != '[':
+            while stream.peek():
+                yield stream.decode()
+            return
+
+        stream.skip()
+        if stream.peek() == ']':
+            return
+        while True:
+            yield stream.decode()
+            separator = stream.peek()
+            stream.skip()
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError(f'{file_in}: expected "," or "]" between array elements, found {separator!r}')
@@ -0,0 +1,72 @@
+"""
+**prefetch.py**
+
+* *Purpose:* Read ahead in a background thread so disk I/O overlaps with the processing of the data already read
+
+"""
+
+import threading
+from queue import Queue, Full
+
+# Number of items read ahead of the consumer by default
+DEFAULT_DEPTH = 2
+
+_END = object()
+
+
+class Prefetcher:
+    """
+    Iterate over read(item) for every item, in order, with a background thread reading
+    up to `depth` items ahead. The queue is bounded, so at most depth + 1 results are in
+    memory at a time. An exception raised by read is re-raised in the consumer.
+    Use it as a context manager (or call close) to stop the thread when the loop ends early.
+    Items may be a generator, consumed in the background thread; with read None the items
+    themselves are read ahead (e.g. documents parsed from a file by a generator).
+    """
+
+    def __init__(self, read, items, depth=DEFAULT_DEPTH):
+        self.read = read
+        self.items = items
+        self.queue = Queue(maxsize=max(1, depth))
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            for item in self.items:
+                if self.stopped.is_set():
+                    return
+                self.put((item if self.read is None else self.read(item), None))
+        except Exception as e:
+            self.put((None, e))
+        self.put((_END, None))
+
+    def put(self, result):
+        """Put a result on the queue, giving up if the consumer stopped listening."""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(result, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def __iter__(self):
+        while True:
+            value, error = self.queue.get()
+            if error is not None:
+                self.close()
+                raise error
+            if value is _END:
+                return
+            yield value
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
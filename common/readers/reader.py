@@ -18,20 +18,39 @@
 """
 
 from abc import ABC, abstractmethod
+from datetime import datetime
+import numpy as np
 
 
 class Reader(ABC):
     """ Abstract class of Reader object"""
-    def __init__(self, file):
-        """ Open a file and get longitudes and latitudes and coordinates rank"""
+
+    # Whether the grid coordinates are the cell corners (n + 1 values) rather than the cell centres
+    cell_corners = False
+    # Whether the file can be read from another thread than the one that opened it (see Prefetcher)
+    thread_safe = True
+
+    def __init__(self, file, bbox=None, stride=1):
+        """ Open a file and get longitudes and latitudes and coordinates rank.
+        bbox = (lon_min, lat_min, lon_max, lat_max) and stride restrict every read to a subset of the grid"""
         self.file = file
+        self.bbox = bbox
+        self.stride = stride or 1
         self.dataset = self.open()
         self.n_longitudes = None
         self.n_latitudes = None
         self.longitudes = self.get_longitudes()
         self.latitudes = self.get_latitudes()
         self.coordinates_rank = self.get_rank(self.longitudes)
+        self.lon_slice, self.lat_slice = self.get_subset_slices()
+        if self.is_subset():
+            self.longitudes = np.asarray(self.longitudes[self.lon_slice])
+            self.latitudes = np.asarray(self.latitudes[self.lat_slice])
+            self.n_longitudes = self.longitudes.shape[0]
+            self.n_latitudes = self.latitudes.shape[0]
         self.ini_ntime = self.get_ini_ntime()
+        self.times, self.time_keys = self.get_time_index()
+        self.time_positions = {int(key): n for n, key in enumerate(self.time_keys)}
         #self.close()
 
     @abstractmethod
@@ -51,17 +70,58 @@ class Reader(ABC):
         pass
 
     @abstractmethod
-    def get_dates(self):
+    def get_time_index(self):
+        """ Decode the time axis once: datetime64 array and the dataset key of each timestep"""
         pass
 
-    @abstractmethod
+    def get_dates(self):
+        """ Dates of all timesteps as a numpy datetime64 array"""
+        return self.times
+
     def get_date(self, n_time):
-        pass
+        """ Date of the timestep stored under the dataset key n_time"""
+        return self.times[self.time_positions[n_time]].astype(datetime)
 
     @abstractmethod
     def get_ini_ntime(self):
         pass
 
+    def is_subset(self) -> bool:
+        return self.bbox is not None or self.stride != 1
+
+    def get_subset_slices(self):
+        """ Longitude and latitude index slices of the bounding box, with the stride"""
+        if not self.is_subset():
+            return slice(None), slice(None)
+        if self.coordinates_rank != 1:
+            raise ValueError('Subsetting by bounding box or stride needs 1D coordinates')
+        if self.bbox is None:
+            return slice(None, None, self.stride), slice(None, None, self.stride)
+        lon_min, lat_min, lon_max, lat_max = self.bbox
+        return (self.get_axis_slice(self.longitudes, lon_min, lon_max, self.stride),
+                self.get_axis_slice(self.latitudes, lat_min, lat_max, self.stride))
+
+    @staticmethod
+    def get_axis_slice(values, low, high, stride=1) -> slice:
+        """ Slice of the indexes of a coordinate axis that fall inside [low, high]"""
+        inside = np.flatnonzero((np.asarray(values[:]) >= low) & (np.asarray(values[:]) <= high))
+        if not inside.size:
+            raise ValueError(f'No grid point inside [{low}, {high}]')
+        return slice(int(inside[0]), int(inside[-1]) + 1, stride)
+
+    @staticmethod
+    def get_sliced_length(length, index_slice) -> int:
+        """ Number of elements an axis of the given length keeps after slicing"""
+        return len(range(*index_slice.indices(length)))
+
+    def get_field_nbytes(self, name_var, n_time) -> int:
+        """ Size in bytes of one timestep of a variable"""
+        return np.asarray(self.get_variable(name_var, n_time)).nbytes
+
+    def get_variable_block(self, name_var, n_times):
+        """ Stack a block of timesteps of a variable into a single array"""
+        return np.stack([np.asarray(self.get_variable(name_var, n_time)) for n_time in n_times])
+
     @staticmethod
     def get_rank(array) -> int:
         """ Number of dimensions of an array"""
@@ -1,12 +1,18 @@
 
-from datetime import datetime
 import numpy as np
 import h5py
 from .reader import Reader
 
+# Chunk cache of chunked/compressed datasets: 64 MB and a prime number of hash slots.
+# Timesteps are read once, so fully read chunks are evicted first (w0 = 1)
+DEFAULT_CHUNK_CACHE = {'rdcc_nbytes': 64 * 1024 ** 2, 'rdcc_nslots': 10007, 'rdcc_w0': 1.0}
+
 
 class ReaderHDF(Reader):
 
+    # MOHID grids store the cell corners
+    cell_corners = True
+
     names = {
         'northward_velocity': '/Results/velocity V/velocity V_',
         'eastward_velocity': '/Results/velocity U/velocity U_',
@@ -25,13 +31,39 @@ class ReaderHDF(Reader):
         '/Results/Spill Location/Data_2D/AirIntMaximumConcentration_2D/AirIntMaximumConcentration_2D_'
     }
 
+    def __init__(self, file, bbox=None, stride=1, chunk_cache=None, memmap=True):
+        """chunk_cache overrides the rdcc settings of DEFAULT_CHUNK_CACHE; memmap=False always reads through h5py"""
+        self.chunk_cache = {**DEFAULT_CHUNK_CACHE, **(chunk_cache or {})}
+        self.memmap = memmap
+        self.file_map = None
+        super().__init__(file, bbox, stride)
+
     def open(self):
-        self.dataset = h5py.File(self.file)
+        self.dataset = h5py.File(self.file, 'r', **self.chunk_cache)
         return self.dataset
 
     def close(self):
+        self.file_map = None
         self.dataset.close()
 
+    def get_memmap(self, variable):
+        """
+        Zero-copy view over the file of a contiguous, uncompressed dataset, or None
+        when the dataset is chunked, filtered, external or not yet written.
+        """
+        if not self.memmap or variable.chunks is not None or variable.external or variable.dtype.hasobject:
+            return None
+        offset = variable.id.get_offset()
+        if offset is None:
+            return None
+        if self.file_map is None:
+            self.file_map = np.memmap(self.file, dtype=np.uint8, mode='r')
+        nbytes = variable.size * variable.dtype.itemsize
+        if offset + nbytes > self.file_map.size:
+            # Written after the file was mapped
+            return None
+        return self.file_map[offset:offset + nbytes].view(variable.dtype).reshape(variable.shape)
+
     def get_latitudes(self):
         lat_in = self.dataset['/Grid/Latitude']
         if len(lat_in.shape) == 1:
@@ -50,23 +82,51 @@ class ReaderHDF(Reader):
             self.n_longitudes = lon_in.shape[0]
             return lon_in[:, 1]
 
-    def get_dates(self):
-        return self.dataset['/Time']
-
-    def get_date(self, n_time):
-        date_in = self.dataset['/Time/Time_' + str(n_time).zfill(5)]
-        return datetime(year=int(date_in[0]), month=int(date_in[1]), day=int(date_in[2]),
-                        hour=int(date_in[3]), minute=int(date_in[4]), second=int(date_in[5]))
+    def get_time_index(self):
+        """Read every /Time/Time_xxxxx vector in one pass and decode them together."""
+        group = self.dataset['/Time']
+        keys = np.array(sorted(int(name.split('_')[-1]) for name in group), dtype=int)
+        vectors = np.array([group['Time_' + str(key).zfill(5)][()] for key in keys]).reshape(-1, 6)
+        return self.date_vectors_to_datetime64(vectors), keys
+
+    @staticmethod
+    def date_vectors_to_datetime64(vectors):
+        """Convert rows of [year, month, day, hour, minute, second] to datetime64[s]."""
+        vectors = np.asarray(vectors, dtype=float)
+        months = (vectors[:, 0].astype(int) - 1970) * 12 + vectors[:, 1].astype(int) - 1
+        days = months.astype('datetime64[M]').astype('datetime64[D]') + (vectors[:, 2].astype(int) - 1)
+        seconds = np.rint(vectors[:, 3] * 3600 + vectors[:, 4] * 60 + vectors[:, 5]).astype('timedelta64[s]')
+        return days.astype('datetime64[s]') + seconds
+
+    def has_var(self, name_var):
+        """Whether the file has the group of the timesteps of a variable."""
+        return name_var in self.names and self.names[name_var].rsplit('/', 1)[0] in self.dataset
 
     def get_variable(self, name_var, n_time):
         path = self.names[name_var]
         variable = self.dataset[path + str(n_time).zfill(5)]
-        if len(variable.shape) == 2:
-            variable = np.transpose(variable)
-        elif len(variable.shape) == 3:
-            variable = np.transpose(variable, (0, 2, 1))
+        mapped = self.get_memmap(variable)
+        if mapped is not None and len(mapped.shape) < 2:
+            variable = mapped
+        elif mapped is not None:
+            # Contiguous dataset: slicing the view only touches the pages of the subset
+            variable = mapped[..., self.lon_slice, self.lat_slice]
+        elif self.is_subset() and len(variable.shape) >= 2:
+            # Hyperslab read: only the subset region leaves the disk
+            variable = variable[..., self.lon_slice, self.lat_slice]
+        # Swapping the last two axes is a strided view, nothing is copied
+        if len(variable.shape) >= 2:
+            variable = np.swapaxes(variable, -1, -2)
         return variable
 
+    def get_field_nbytes(self, name_var, n_time):
+        variable = self.dataset[self.names[name_var] + str(n_time).zfill(5)]
+        shape = variable.shape
+        if len(shape) >= 2:
+            shape = shape[:-2] + (self.get_sliced_length(shape[-2], self.lon_slice),
+                                  self.get_sliced_length(shape[-1], self.lat_slice))
+        return int(np.prod(shape)) * variable.dtype.itemsize
+
     def get_ini_ntime(self):
         return 1
 
@@ -1,16 +1,48 @@
 
-from datetime import datetime
+import numpy as np
 import netCDF4
 from .reader import Reader
 
 
 class ReaderNetCDF(Reader):
 
+    # netCDF4 handles are not thread safe: no read-ahead thread on them
+    thread_safe = False
+
     def open(self):
         dataset = netCDF4.Dataset(self.file)
         self.variables = dataset.variables
+        self.catalogue = self.build_catalogue(self.variables)
         return dataset
 
+    @staticmethod
+    def build_catalogue(variables):
+        """
+        Index variables by CF standard_name, long_name and their own name.
+        Attribute names take precedence over variable names and, as in a sequential
+        scan, the first variable that declares a name keeps it.
+        """
+        catalogue = {}
+        for var in variables:
+            for attribute in ('standard_name', 'long_name'):
+                if attribute in variables[var].ncattrs():
+                    catalogue.setdefault(getattr(variables[var], attribute), var)
+        for var in variables:
+            catalogue.setdefault(var, var)
+        return catalogue
+
+    def list_variables(self):
+        """Describe the variables the file provides (name, CF names, units and shape)."""
+        return [{'name': var,
+                 'standard_name': getattr(self.variables[var], 'standard_name', None),
+                 'long_name': getattr(self.variables[var], 'long_name', None),
+                 'units': getattr(self.variables[var], 'units', None),
+                 'shape': self.variables[var].shape}
+                for var in self.variables]
+
+    def has_var(self, var_name):
+        return var_name in self.catalogue
+
     def close(self):
         self.dataset.close()
 
@@ -30,28 +62,44 @@ class ReaderNetCDF(Reader):
             self.n_longitudes = lon_in.shape[0]
         return lon_in
 
-    def get_dates(self):
+    def get_time_index(self):
+        """Decode the CF time variable once; timestep n is stored under key n."""
         times_in = self.get_var('time')
-        return netCDF4.num2date(times_in[:], units=times_in.units)
-
-    def get_date(self, n_time):
-        return self.get_dates()[n_time]
+        dates = netCDF4.num2date(times_in[:], units=times_in.units,
+                                 calendar=getattr(times_in, 'calendar', 'standard'),
+                                 only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+        times = np.array(np.ravel(dates), dtype='datetime64[s]')
+        return times, np.arange(times.size) + self.get_ini_ntime()
 
     def get_variable(self, var_name, n_time):
+        if self.is_subset():
+            # CF order (time, [depth,] latitude, longitude): hyperslab of the subset region
+            return self.get_var(var_name)[n_time, ..., self.lat_slice, self.lon_slice]
         return self.get_var(var_name)[n_time, ]
 
+    def get_field_nbytes(self, var_name, n_time):
+        variable = self.get_var(var_name)
+        shape = variable.shape[1:]
+        if len(shape) >= 2:
+            shape = shape[:-2] + (self.get_sliced_length(shape[-2], self.lat_slice),
+                                  self.get_sliced_length(shape[-1], self.lon_slice))
+        return int(np.prod(shape)) * variable.dtype.itemsize
+
+    def get_variable_block(self, var_name, n_times):
+        """Read a run of consecutive timesteps as a single hyperslab."""
+        n_times = list(n_times)
+        if n_times == list(range(n_times[0], n_times[-1] + 1)):
+            time_slice = slice(n_times[0], n_times[-1] + 1)
+            if self.is_subset():
+                return self.get_var(var_name)[time_slice, ..., self.lat_slice, self.lon_slice]
+            return self.get_var(var_name)[time_slice, ]
+        return super().get_variable_block(var_name, n_times)
+
     def get_var(self, var_name):
         """Return values using the CF standard name of a variable in a netCDF file."""
-        for var in self.variables:
-            for atributo in (self.variables[var].ncattrs()):
-                if atributo == 'standard_name':
-                    nome_atributo = (getattr(self.variables[var], 'standard_name'))
-                    if nome_atributo == var_name:
-                        return self.variables[var]
-                elif atributo == 'long_name':
-                    nome_atributo = (getattr(self.variables[var], 'long_name'))
-                    if nome_atributo == var_name:
-                        return self.variables[var]
+        var = self.catalogue.get(var_name)
+        if var is not None:
+            return self.variables[var]
 
     def get_ini_ntime(self):
         return 0
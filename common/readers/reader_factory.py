@@ -1,15 +1,14 @@
 import sys
 from abc import ABC, abstractmethod
 from .reader import Reader
-from .reader_HDF import ReaderHDF
-from .reader_NetCDF import ReaderNetCDF
 
 
 class ReaderFactory(ABC):
     """Basic class of factory readers"""
 
-    def __init__(self, file_in):
+    def __init__(self, file_in, **options):
         self.file_in = file_in
+        self.options = options
 
     @abstractmethod
     def get_reader(self) -> Reader:
@@ -20,18 +19,23 @@ class ReaderHDFFactory(ReaderFactory):
     """Factory for Reader of HDF files"""
 
     def get_reader(self) -> Reader:
-        return ReaderHDF(self.file_in)
+        # h5py is imported on first use only
+        from .reader_HDF import ReaderHDF
+        return ReaderHDF(self.file_in, **self.options)
 
 
 class ReaderNetCDFFactory(ReaderFactory):
     """ Factoyr for Reader of NetCDF files"""
 
     def get_reader(self) -> Reader:
-        return ReaderNetCDF(self.file_in)
+        # netCDF4 is imported on first use only
+        from .reader_NetCDF import ReaderNetCDF
+        return ReaderNetCDF(self.file_in, **self.options)
 
 
-def read_factory(file_in) -> ReaderFactory:
-    """ Construct a reader factory based on the extension of file"""
+def read_factory(file_in, **options) -> ReaderFactory:
+    """ Construct a reader factory based on the extension of file.
+    Options (e.g. bbox, stride) are passed on to the reader"""
 
     factories = {
         "nc": ReaderNetCDFFactory,
@@ -42,7 +46,7 @@ def read_factory(file_in) -> ReaderFactory:
 
     extension = file_in.split('.')[-1]
     if extension in factories:
-        return factories[extension](file_in)
+        return factories[extension](file_in, **options)
     print(f'Unknown file extension {extension}')
     sys.exit(1)
 
@@ -0,0 +1,55 @@
+"""
+**tools.py**
+
+* *Purpose:* Loading of the ETL tools by name. The tools are scripts run from their own
+  directory, not packages: the directory of a tool is put on sys.path and its module
+  imported on first use, so a process only pays for the imports of the tools it runs.
+
+"""
+
+import os
+import sys
+import importlib
+import threading
+import multiprocessing
+
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools')
+
+TOOLS = ('aloha2cop', 'mohid2cop', 'cedre_json2cop', 'cop_daemon')
+
+
+def get_tool_dir(tool):
+    if tool not in TOOLS:
+        raise ValueError(f'Unknown tool: {tool}')
+    return os.path.join(TOOLS_DIR, tool)
+
+
+def get_tool_config(tool):
+    """Default JSON configuration of a tool, next to its script."""
+    return os.path.join(get_tool_dir(tool), f'{tool}.json')
+
+
+def get_file_simulation(simulation, file_in):
+    """Simulation of one of many input files: the configured one, suffixed with the file name."""
+    stem = os.path.splitext(os.path.basename(file_in))[0]
+    return {'name': f"{simulation['name']}_{stem}",
+            'description': f"{simulation['description']} ({os.path.basename(file_in)})"}
+
+
+def get_process_context():
+    """
+    Start method of the process pools of a tool: the default one in the main thread, spawn
+    in any other (e.g. a worker thread of cop_daemon), where forking could copy locks held
+    by the other threads into the child.
+    """
+    if threading.current_thread() is threading.main_thread():
+        return None
+    return multiprocessing.get_context('spawn')
+
+
+def load_tool(tool):
+    """Import the module of a tool (aloha2cop, mohid2cop, ...)."""
+    tool_dir = get_tool_dir(tool)
+    if tool_dir not in sys.path:
+        sys.path.append(tool_dir)
+    return importlib.import_module(tool)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+COPTOOL: Single entry point of the COPTool_Utils ETL tools.
+
+Technical Description:
+    One subcommand per tool. Only the module of the chosen tool is imported,
+    and the format backends (h5py, netCDF4, scikit-image, shapely) load when
+    first used, so a CEDRE or ALOHA ingestion does not pay for the MOHID stack.
+
+    The configuration is the JSON file of the tool (tools/<tool>/<tool>.json by
+    default); relative paths in it are read from its directory, as when the
+    tool runs from its own directory. file_in, if given, replaces the one of the
+    configuration.
+
+Usage (from anywhere, no PYTHONPATH needed):
+    python coptool.py aloha  [file_in] [-c config.json] [--log-level DEBUG]
+    python coptool.py mohid  [file_in] [-c config.json]
+    python coptool.py cedre  [file_in] [-c config.json]
+    python coptool.py daemon [-c cop_daemon.json]
+
+Version: 1.0.0
+Date: 2026-02-17
+"""
+
+import os
+import argparse
+from common.metrics import metrics, setup_logging
+from common.tools import load_tool, get_tool_config
+
+# Subcommand -> tool
+COMMANDS = {
+    'aloha': 'aloha2cop',
+    'mohid': 'mohid2cop',
+    'cedre': 'cedre_json2cop',
+    'daemon': 'cop_daemon',
+}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='coptool', description='COPTool_Utils ingestion tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, tool in COMMANDS.items():
+        subparser = subparsers.add_parser(command, help=f'run {tool}')
+        if command != 'daemon':
+            subparser.add_argument('file_in', nargs='?', help='input file (replaces file_in of the configuration)')
+        subparser.add_argument('-c', '--config', default=get_tool_config(tool), help='JSON configuration')
+        subparser.add_argument('--log-level', help='DEBUG, INFO or WARNING (replaces log level of the configuration)')
+    return parser
+
+
+def main(args=None):
+    args = get_parser().parse_args(args)
+    config = os.path.abspath(args.config)
+    file_in = getattr(args, 'file_in', None)
+    if file_in:
+        file_in = os.path.abspath(file_in)
+
+    module = load_tool(COMMANDS[args.command])
+    from common.readers.inout import read_input
+    os.chdir(os.path.dirname(config))
+    inputs = read_input(os.path.basename(config), module.INPUT_KEYS)
+    if file_in:
+        inputs['file_in'] = file_in
+    if args.log_level:
+        inputs['log level'] = args.log_level
+    setup_logging(inputs.get('log level', 'INFO'))
+    metrics.reset(COMMANDS[args.command])
+    module.main(inputs)
+
+
+if __name__ == "__main__":
+    main()
@@ -38,64 +38,193 @@ Author: Pedro Montero / INTECMAR
 Version: 1.1.0
 Date: 2026-02-16
 """
+import os
+import glob
+import time
+import logging
+import psycopg2
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from common.readers.inout import read_input
 from aloha_reader import Aloha
 from common.database.cop_sql import CopQuery
+from common.database.geometry import to_wkb
+from common.database.manifest import IngestionManifest, ingest_once
+from common.metrics import metrics, setup_logging, init_worker
+from common.tools import get_file_simulation, get_process_context
+
+log = logging.getLogger(__name__)
+
+# Keys asked for when the JSON configuration does not exist yet
+INPUT_KEYS = ['file_in', 'campaign', 'model', 'simulations', 'initial date']
+
+# Extensions of the ALOHA exports picked up from a directory
+ALOHA_EXTENSIONS = ('*.kml', '*.kmz')
 
 
 def read_aloha(file_in):
     aloha = Aloha(file_in)
-    print(f'Reading {aloha.kml_file}')
+    log.info('Reading %s', aloha.kml_file)
     aloha.set_loc_type()
     aloha.set_category()
     return aloha
 
 
-def main(inputs):
+def list_input_files(file_in):
+    """ALOHA files named by file_in: a single file, every KML of a directory, or a glob pattern."""
+    if os.path.isdir(file_in):
+        return sorted(path for pattern in ALOHA_EXTENSIONS for path in glob.glob(os.path.join(file_in, pattern)))
+    if glob.has_magic(file_in):
+        return sorted(glob.glob(file_in))
+    return [file_in]
+
+
+def parse_aloha(file_in, precision=None):
+    """
+    Process pool task: parse one ALOHA file into its LOC type and (level, WKB, name) threat zones,
+    with the metrics recorded by the worker for it.
+    """
+    aloha = read_aloha(file_in)
+    threat_zones = [(threat_zone.level, to_wkb(threat_zone.geometry, precision), threat_zone.name)
+                    for threat_zone in aloha.threat_zones if getattr(threat_zone, 'geometry', None) is not None]
+    return file_in, aloha.loc_type, threat_zones, metrics.take()
+
+
+def batch_main(inputs, files, manifest=None):
+    """
+    Ingest many ALOHA scenarios: the files are parsed in parallel on a process pool and
+    loaded by a single pooled connection, one simulation per file and one multi-row
+    INSERT of lines per simulation. Files of the manifest are skipped before parsing.
+    """
+    campaign, model, simulation = inputs['campaign'], inputs['model'], inputs['simulation']
+    initial_datetime = datetime.strptime(inputs['initial date'], "%Y-%m-%d %H:%M:%S")
+    precision = inputs.get('precision')
+    # Batch runs name one simulation per file, which is part of what the manifest records
+    configs = {file: dict(inputs, simulation=get_file_simulation(simulation, file)) for file in files}
+    n_skipped = 0
+    if manifest is not None:
+        # Claimed before parsing: a concurrent sweep skips them, the failed ones are released
+        pending = [file for file in files if manifest.claim(file, 'aloha2cop', configs[file])]
+        n_skipped, files = len(files) - len(pending), pending
+    log.info('Batch of %s ALOHA files (%s already ingested)', len(files), n_skipped)
+
+    start = time.perf_counter()
+    n_files, n_lines, failed = 0, 0, []
+    aloha_query = CopQuery()
+    aloha_query.connect()
+    try:
+        with ProcessPoolExecutor(max_workers=inputs.get('processes'), mp_context=get_process_context(),
+                                 initializer=init_worker) as executor:
+            futures = [executor.submit(parse_aloha, file, precision) for file in files]
+            for file, future in zip(files, futures):
+                try:
+                    file_in, loc_type, threat_zones, worker_metrics = future.result()
+                except Exception as e:
+                    log.warning('CAUTION: %s could not be parsed: %s', file, e)
+                    failed.append(file)
+                    if manifest is not None:
+                        manifest.release(file, 'aloha2cop', configs[file])
+                    continue
+                metrics.merge(worker_metrics)
+                try:
+                    id_loc = aloha_query.set_loc_hierarchy(campaign, model, configs[file]['simulation'],
+                                                           initial_datetime, loc_type)
+                    n_file_lines = aloha_query.set_lines(id_loc, threat_zones)
+                except psycopg2.Error as e:
+                    # Keep the batch going: the failed transaction is rolled back and the file is not recorded
+                    log.warning('CAUTION: %s could not be loaded: %s', file_in, e)
+                    aloha_query.recover()
+                    failed.append(file_in)
+                    if manifest is not None:
+                        manifest.release(file, 'aloha2cop', configs[file])
+                    continue
+                if not n_file_lines:
+                    log.warning('CAUTION: LOC %s already has the lines of %s, nothing ingested', id_loc, file_in)
+                    failed.append(file_in)
+                    if manifest is not None:
+                        manifest.release(file, 'aloha2cop', configs[file])
+                    continue
+                n_lines += n_file_lines
+                n_files += 1
+                if manifest is not None:
+                    manifest.record(file, 'aloha2cop', configs[file], {'loc': id_loc})
+    finally:
+        aloha_query.close()
+
+    elapsed = time.perf_counter() - start
+    metrics.count('files', n_files)
+    metrics.count('files skipped', n_skipped)
+    log.info('\n---------------BATCH SUMMARY--------------')
+    log.info('Files ingested: %s of %s (%s failed)', n_files, len(files), len(failed))
+    log.info('Lines inserted: %s', n_lines)
+    log.info('Elapsed: %.2f s (%.2f files/s, %.2f lines/s)', elapsed,
+             n_files / elapsed if elapsed else 0, n_lines / elapsed if elapsed else 0)
+
+
+def ingest(inputs):
+    """Ingestion of a single ALOHA file: returns the ids to record in the manifest."""
     file_in, campaign, model, simulation, initial_date = inputs['file_in'], inputs['campaign'],\
                                                          inputs['model'], inputs['simulation'], inputs['initial date']
-    print(f'file_in = {file_in}')
-    print(f'campaigns = {campaign}')
+    log.info('file_in = %s', file_in)
+    log.info('campaigns = %s', campaign)
     initial_datetime = datetime.strptime(initial_date, "%Y-%m-%d %H:%M:%S")
 
     aloha = read_aloha(file_in)
 
     for threat_zone in aloha.threat_zones:
-       print(f'NAME: The name of the threat zone is {threat_zone.name}')
-       print(f'     DESCRIPTION: \n     {threat_zone.description}')
-       print(f'     LEVEL:     {threat_zone.level}\n\n')
+       log.debug('NAME: The name of the threat zone is %s', threat_zone.name)
+       log.debug('     DESCRIPTION: \n     %s', threat_zone.description)
+       log.debug('     LEVEL:     %s\n\n', threat_zone.level)
 
     aloha_query = CopQuery()
     aloha_query.connect()
+    try:
+        # Resolve campaign -> model -> simulation -> output -> LOC (ids come back from each insert)
+        id_loc = aloha_query.set_loc_hierarchy(campaign, model, simulation, initial_datetime, aloha.loc_type)
+
+        log.debug('id_loc = %s, levels = %s', id_loc, [threat_zone.level for threat_zone in aloha.threat_zones])
+        n_lines = aloha_query.set_lines(id_loc, [(threat_zone.level, threat_zone.geometry, threat_zone.name)
+                                                 for threat_zone in aloha.threat_zones
+                                                 if getattr(threat_zone, 'geometry', None) is not None],
+                                        inputs.get('precision'))
+    except Exception:
+        aloha_query.rollback()
+        raise
+    finally:
+        # The connection always goes back to the pool, whatever failed
+        aloha_query.close()
+
+    # The lines of a LOC are never replaced: a file whose LOC already has them loaded nothing
+    if not n_lines:
+        log.warning('CAUTION: LOC %s already has the lines of %s, nothing ingested', id_loc, file_in)
+        return None
+    log.info('\n\n---------------END--------------')
+    return {'loc': id_loc, 'lines': n_lines}
 
-    campaign_name = campaign['name']
-    campaign_description = campaign['description']
-    aloha_query.set_id_campaign(campaign_name, campaign_description)
-
-    model = inputs['model']
-    aloha_query.set_id_model(model)
-
-    simulation_name = simulation['name']
-    simulation_description = simulation['description']
-    aloha_query.set_id_simulation(campaign_name, model, simulation_name, simulation_description)
-
-    id_simulation = aloha_query.get_id_simulation_by_chars(campaign_name, model, simulation_name)
-    aloha_query.set_id_output(id_simulation, initial_datetime, 'LOC AREAS')
 
-    id_output = aloha_query.get_id_output(id_simulation, initial_datetime, 'LOC AREAS')
-    aloha_query.set_id_loc(id_output, aloha.loc_type)
-
-    id_loc = aloha_query.get_loc_id_by_type(id_output, aloha.loc_type)
-    for threat_zone in aloha.threat_zones:
-        print(f'id_loc = {id_loc}, threat_zone.level = {threat_zone.level}')
-        aloha_query.set_line(id_loc, threat_zone.level, threat_zone.geometry, threat_zone.name)
-
-    aloha_query.con.close()
-    print('\n\n---------------END--------------')
+def main(inputs):
+    """
+    Ingest a single ALOHA file, or a batch (directory or glob pattern). Returns the ids
+    recorded for a single file, None if it was not ingested (or for a batch).
+    """
+    file_in = inputs['file_in']
+    files = list_input_files(file_in)
+    if len(files) != 1 or files[0] != file_in:
+        if inputs.get('manifest'):
+            # Optional manifest of the inputs already ingested: unchanged files are skipped
+            with IngestionManifest(inputs['manifest']) as manifest:
+                batch_main(inputs, files, manifest)
+        else:
+            batch_main(inputs, files)
+        ids = None
+    else:
+        ids = ingest_once(inputs.get('manifest'), file_in, 'aloha2cop', inputs, lambda: ingest(inputs))
+    metrics.export(inputs.get('metrics'))
+    return ids
 
 
 if __name__ == "__main__":
-    input_keys = ['file_in', 'campaign', 'model', 'simulations', 'initial date']
-    inputs = read_input('aloha2cop.json', input_keys)
+    inputs = read_input('aloha2cop.json', INPUT_KEYS)
+    setup_logging(inputs.get('log level', 'INFO'))
+    metrics.reset('aloha2cop')
     main(inputs)
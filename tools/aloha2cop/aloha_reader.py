@@ -39,9 +39,24 @@ Version: 1.0.0
 Date: 2026-02-16
 """
 
-from fastkml import kml
+import zipfile
+import logging
+from contextlib import contextmanager
 import xml.etree.ElementTree as ET
-from shapely.geometry import Polygon
+import numpy as np
+from common.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# Define namespaces
+ns = {
+    'kml': 'http://www.opengis.net/kml/2.2',
+    'gx': 'http://www.google.com/kml/ext/2.2'
+}
+KML_FOLDER = '{%s}Folder' % ns['kml']
+KML_NAME = '{%s}name' % ns['kml']
+KML_PLACEMARK = '{%s}Placemark' % ns['kml']
+THREAT_ZONES_FOLDER = 'Aloha Threat Zones'
 
 
 class ThreatZone:
@@ -86,62 +101,102 @@ class Aloha:
         self.category = None
         self.parse_kml_direct()
 
+    @contextmanager
+    def open_kml(self):
+        """Binary stream of the KML document; a KMZ archive is read from the zip without extracting it."""
+        if zipfile.is_zipfile(self.kml_file):
+            with zipfile.ZipFile(self.kml_file) as kmz:
+                names = [name for name in kmz.namelist() if name.lower().endswith('.kml')]
+                if not names:
+                    raise ValueError(f'No KML document inside {self.kml_file}')
+                # doc.kml is the main document of a KMZ by convention
+                name = 'doc.kml' if 'doc.kml' in names else names[0]
+                with kmz.open(name) as stream:
+                    yield stream
+        else:
+            with open(self.kml_file, 'rb') as stream:
+                yield stream
+
+    @metrics.timed('parse')
     def parse_kml_direct(self):
-        """Parse KML directly using ElementTree"""
-        tree = ET.parse(self.kml_file)
-        root = tree.getroot()
-
-        # Define namespaces
-        ns = {
-            'kml': 'http://www.opengis.net/kml/2.2',
-            'gx': 'http://www.google.com/kml/ext/2.2'
-        }
-
-        # Busca el Folder "Aloha Threat Zones"
-        for folder in root.findall('.//kml:Folder', ns):
-            folder_name_elem = folder.find('kml:name', ns)
-            if folder_name_elem is not None and folder_name_elem.text == 'Aloha Threat Zones':
-                print(f'Found Aloha Threat Zones folder')
-
-                # Procesa cada Placemark
-                for placemark in folder.findall('kml:Placemark', ns):
-                    threat_zone = ThreatZone()
-
-                    # Obtén el nombre
-                    name_elem = placemark.find('kml:name', ns)
-                    if name_elem is not None:
-                        threat_zone.name = name_elem.text
-
-                    # Obtén la descripción
-                    desc_elem = placemark.find('kml:description', ns)
-                    if desc_elem is not None:
-                        threat_zone.description = desc_elem.text
-
-                    # Obtén las coordenadas
-                    coords_elem = placemark.find('.//kml:coordinates', ns)
-                    if coords_elem is not None:
-                        coords_text = coords_elem.text.strip()
-                        # Parsea las coordenadas
-                        coord_pairs = []
-                        for coord in coords_text.split():
-                            parts = coord.split(',')
-                            if len(parts) >= 2:
-                                lon, lat = float(parts[0]), float(parts[1])
-                                coord_pairs.append((lon, lat))
-
-                        # Crea el polígono con Shapely
-                        if coord_pairs:
-                            threat_zone.geometry = Polygon(coord_pairs)
-
-                    # Establece el nivel
-                    threat_zone.set_level()
-
-                    if threat_zone.name:  # Solo añade si tiene nombre
-                        self.threat_zones.append(threat_zone)
-                        print(f'  Added: {threat_zone.name} -> {threat_zone.level}')
-
-        print(f'\nTotal threat zones found: {len(self.threat_zones)}')
-
+        """
+        Parse the KML with a streaming iterparse.
+        Only the Placemarks of the "Aloha Threat Zones" folder are processed, and every
+        Placemark and Folder is freed once read, so memory stays flat on large exports.
+        """
+        with self.open_kml() as stream:
+            tags = []          # Open elements
+            folder_names = []  # Name of every open Folder
+            for event, elem in ET.iterparse(stream, events=('start', 'end')):
+                if event == 'start':
+                    tags.append(elem.tag)
+                    if elem.tag == KML_FOLDER:
+                        folder_names.append(None)
+                    continue
+
+                tags.pop()
+                parent = tags[-1] if tags else None
+                if elem.tag == KML_NAME and parent == KML_FOLDER:
+                    folder_names[-1] = elem.text
+                    if elem.text == THREAT_ZONES_FOLDER:
+                        log.debug('Found Aloha Threat Zones folder')
+                elif elem.tag == KML_PLACEMARK:
+                    if parent == KML_FOLDER and folder_names[-1] == THREAT_ZONES_FOLDER:
+                        self.add_threat_zone(elem)
+                    elem.clear()
+                elif elem.tag == KML_FOLDER:
+                    folder_names.pop()
+                    elem.clear()
+
+        log.info('Total threat zones found: %s', len(self.threat_zones))
+        metrics.count('placemarks', len(self.threat_zones))
+
+    def add_threat_zone(self, placemark):
+        """Build a threat zone from a Placemark of the "Aloha Threat Zones" folder"""
+        threat_zone = ThreatZone()
+
+        # Obtén el nombre
+        name_elem = placemark.find('kml:name', ns)
+        if name_elem is not None:
+            threat_zone.name = name_elem.text
+
+        # Obtén la descripción
+        desc_elem = placemark.find('kml:description', ns)
+        if desc_elem is not None:
+            threat_zone.description = desc_elem.text
+
+        # Obtén las coordenadas
+        coords_elem = placemark.find('.//kml:coordinates', ns)
+        if coords_elem is not None and coords_elem.text:
+            coord_pairs = self.parse_coordinates(coords_elem.text)
+
+            # Crea el polígono con Shapely (importado solo al usarlo)
+            if len(coord_pairs):
+                from shapely.geometry import Polygon
+                threat_zone.geometry = Polygon(coord_pairs)
+
+        # Establece el nivel
+        threat_zone.set_level()
+
+        if threat_zone.name:  # Solo añade si tiene nombre
+            self.threat_zones.append(threat_zone)
+            log.debug('  Added: %s -> %s', threat_zone.name, threat_zone.level)
+
+    @staticmethod
+    def parse_coordinates(coords_text):
+        """
+        Convert a KML coordinates block ("lon,lat[,alt] ...") to an (n, 2) array of lon, lat
+        in one vectorized parse. Blocks mixing 2D and 3D tuples fall back to a per-tuple parse.
+        """
+        tuples = coords_text.split()
+        if not tuples:
+            return np.empty((0, 2))
+        width = tuples[0].count(',') + 1
+        values = np.array(coords_text.replace(',', ' ').split(), dtype=float)
+        if width >= 2 and values.size == width * len(tuples):
+            return values.reshape(-1, width)[:, :2]
+        coord_pairs = [coord.split(',')[:2] for coord in tuples if coord.count(',') >= 1]
+        return np.array(coord_pairs, dtype=float).reshape(-1, 2)
 
     def set_loc_type(self):
         if not self.threat_zones:
@@ -149,18 +204,18 @@ class Aloha:
 
         loc_types = ['PAC', 'LEL', 'AEGL', 'IDLH']
         name = self.threat_zones[0].name
-        print(f'Checking LOC type for: {name}')
+        log.debug('Checking LOC type for: %s', name)
         res = [ele in name for ele in loc_types]
         index = [i for i, val in enumerate(res) if val]
         if not index:
             raise ValueError(f"No valid LOC type found in threat zone name: {name}")
         self.loc_type = loc_types[index[0]]
-        print(f'LOC type set to: {self.loc_type}')
+        log.info('LOC type set to: %s', self.loc_type)
 
     def set_category(self):
         category = {'PAC': 'TOXIC', 'AEGL': 'TOXIC', 'LEL': 'FLAMMABLE', 'IDLH': 'TOXIC'}
         self.category = category[self.loc_type]
-        print(f'Category set to: {self.category}')
+        log.info('Category set to: %s', self.category)
 
 
 def main(file):
@@ -42,75 +42,159 @@ Version: 1.0.0
 Date: 2026-02-17
 """
 
-import json
+import logging
+import os
+from itertools import islice
 from common.readers.inout import read_input
+from common.readers.json_stream import iter_json_documents
+from common.readers.prefetch import Prefetcher, DEFAULT_DEPTH
 from common.database.cedre_sql import CedreQuery
+from common.database.manifest import ingest_once
+from common.metrics import metrics, setup_logging
 
+log = logging.getLogger(__name__)
 
-def main(inputs):
+# Keys asked for when the JSON configuration does not exist yet
+INPUT_KEYS = ['file_in']
+
+
+def read_batches(file_in, batch_size):
+    """Incident documents of a POLREP file (one incident, a JSON array or NDJSON), in lists of batch_size."""
+    documents = iter_json_documents(file_in)
+    while True:
+        with metrics.stage('read'):
+            batch = list(islice(documents, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def log_rejected(document, error):
+    log.error('\nCRITICAL ERROR during ingestion of incident %s: %s', document.get("chrono"), error)
+    log.error('    The incident has been rolled back.')
+
+
+def log_skipped(skipped):
+    for chrono in skipped:
+        log.warning('CAUTION: incident %s already loaded, skipped', chrono)
+    metrics.count('incidents skipped', len(skipped))
+
+
+def load_batch(db_query, batch):
     """
-    Main execution flow for Cedre JSON data ingestion.
+    Insert a batch of incidents in one transaction, skipping those already in the database.
+    If the batch is rejected, its incidents are inserted one by one, so a faulty incident
+    is the only one lost.
+    Returns the IDs inserted, the rows per table and the number of incidents rejected.
+    """
+    try:
+        incident_ids, counts, skipped = db_query.insert_incident_batch(batch)
+        log_skipped(skipped)
+        return incident_ids, counts, 0
+    except Exception as e:
+        if len(batch) == 1 and batch[0].get("chrono") is not None:
+            log_rejected(batch[0], e)
+            return [], {}, 1
+        log.warning('CAUTION: batch of %s incidents rolled back (%s), inserting them one by one', len(batch), e)
+
+    incident_ids, counts, n_failed = [], {}, 0
+    for document in batch:
+        try:
+            incident_id, document_counts = db_query.insert_incident_document(document)
+        except Exception as e:
+            log_rejected(document, e)
+            n_failed += 1
+            continue
+        if incident_id is None:
+            log_skipped([document.get("chrono")])
+            continue
+        incident_ids.append(incident_id)
+        for table, n_rows in document_counts.items():
+            counts[table] = counts.get(table, 0) + n_rows
+    return incident_ids, counts, n_failed
+
+
+def ingest(inputs):
+    """
+    Ingestion of a POLREP file: returns the ids to record in the manifest, None if it was
+    not loaded whole.
     """
     # 1. Extract inputs from JSON configuration
     file_in = inputs['file_in']
+    batch_size = inputs.get('batch size', CedreQuery.BATCH_SIZE)
+    log.info('Processing file: %s', file_in)
 
-    print(f'Processing file: {file_in}')
-
-    # 2. Read the JSON file
-    # Unlike Mohid which requires complex HDF5 parsing, we can load JSON directly
-    try:
-        with open(file_in, 'r') as f:
-            incident_data = json.load(f)
-    except FileNotFoundError:
-        print(f"Error: File {file_in} not found.")
-        return
-
-    # 3. Database Interaction via CedreQuery (Extends CopQuery)
+    # 2. Database Interaction via CedreQuery (Extends CopQuery)
     # This replaces the specific DatabaseHandler from the original script
     db_query = CedreQuery()
     db_query.connect()
 
+    incident_ids, totals, n_failed, completed = [], {}, 0, False
     try:
-        print('--> Ingesting Incident data...')
-        # Insert incident and retrieve the auto-generated ID
-        incident_id = db_query.insert_incident(incident_data)
-        print(f'    Incident inserted successfully. ID: {incident_id}')
-
-        # 4. Ingest Pollutions and associated Positions
-        if "pollutions" in incident_data:
-            print(f'--> Processing {len(incident_data["pollutions"])} pollution records...')
-            for pollution in incident_data["pollutions"]:
-                db_query.insert_pollution(pollution, incident_id)
-
-                # Insert positions associated with this pollution
-                if "positions" in pollution:
-                    for position in pollution["positions"]:
-                        db_query.insert_position(position, pollution["uuid"])
-
-        # 5. Ingest Messages
-        if "messages" in incident_data:
-            print(f'--> Processing {len(incident_data["messages"])} messages...')
-            for message in incident_data["messages"]:
-                db_query.insert_message(message, incident_id)
-
-        # 6. Ingest Meteo Bulletins
-        if "bulletinsMeteo" in incident_data:
-            print(f'--> Processing {len(incident_data["bulletinsMeteo"])} meteo bulletins...')
-            for bulletin in incident_data["bulletinsMeteo"]:
-                db_query.insert_bulletin_meteo(bulletin, incident_id)
-
-        print('\n--------------- SUCCESSFUL INGESTION --------------')
+        log.info('--> Ingesting Incident data...')
+        # 3. Stream the JSON file: the next batches are parsed while the current one is loaded.
+        # Incident, pollutions, positions, messages and meteo bulletins of a batch are written
+        # in a single transaction: a failure leaves nothing half-ingested
+        with Prefetcher(None, read_batches(file_in, batch_size), DEFAULT_DEPTH) as batches:
+            for batch in batches:
+                batch_ids, counts, batch_failed = load_batch(db_query, batch)
+                incident_ids += batch_ids
+                n_failed += batch_failed
+                for table, n_rows in counts.items():
+                    totals[table] = totals.get(table, 0) + n_rows
+                log.debug('    Incidents inserted: %s', batch_ids)
+        completed = True
 
     except Exception as e:
-        print(f'\nCRITICAL ERROR during ingestion: {e}')
-        # In a production environment, you might want to rollback here
+        log.error('\nCRITICAL ERROR reading %s: %s', file_in, e)
+        log.error('    The incidents inserted before the error are kept.')
     finally:
-        # Ensure connection is closed even if errors occur
-        db_query.con.close()
+        # Ensure the connection goes back to the pool even if errors occur
+        db_query.close()
+
+    metrics.count('bytes read', os.path.getsize(file_in))
+    metrics.count('incidents', len(incident_ids))
+    if len(incident_ids) == 1:
+        log.info('    Incident inserted successfully. ID: %s', incident_ids[0])
+    else:
+        log.info('    Incidents inserted: %s (%s rejected)', len(incident_ids), n_failed)
+    log.info('--> Processed %s pollution records with %s positions...',
+             totals.get("pollution", 0), totals.get("position", 0))
+    log.info('--> Processed %s messages...', totals.get("message", 0))
+    log.info('--> Processed %s meteo bulletins...', totals.get("bulletin_meteo", 0))
+
+    # Only a file loaded whole is recorded: a partial one is reported and can be fixed and sent
+    # again, its incidents already loaded are skipped
+    if not completed or n_failed:
+        return None
+    log.info('\n--------------- SUCCESSFUL INGESTION --------------')
+    if len(incident_ids) == 1:
+        return {'incident': incident_ids[0]}
+    return {'incidents': incident_ids}
+
+
+def main(inputs):
+    """
+    Main execution flow for Cedre JSON data ingestion.
+    A file holds one incident, or many as a JSON array or NDJSON (bulk exports): incidents
+    are parsed one at a time in a background thread and loaded in batches of "batch size"
+    incidents, one transaction and one multi-row INSERT per table for each batch.
+    Returns the ids recorded, None if the file was not ingested whole.
+    """
+    file_in = inputs['file_in']
+    ids = None
+    if not os.path.isfile(file_in):
+        log.error("Error: File %s not found.", file_in)
+    else:
+        # Optional manifest of the inputs already ingested: a POLREP is never inserted twice
+        ids = ingest_once(inputs.get('manifest'), file_in, 'cedre_json2cop', inputs, lambda: ingest(inputs))
+    metrics.export(inputs.get('metrics'))
+    return ids
 
 
 if __name__ == "__main__":
     # Load configuration keys from JSON
-    input_keys = ['file_in']
-    inputs = read_input('cedre_json2cop.json', input_keys)
+    inputs = read_input('cedre_json2cop.json', INPUT_KEYS)
+    setup_logging(inputs.get('log level', 'INFO'))
+    metrics.reset('cedre_json2cop')
     main(inputs)
\ No newline at end of file
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+COP_DAEMON: Watch-folder ingestion daemon for the COPTool_Utils ETL tools.
+
+Technical Description:
+    Long-running process that watches drop folders for ALOHA KML/KMZ, MOHID
+    HDF5/NetCDF and CEDRE POLREP JSON files and hands every new (or modified)
+    file to the pipeline of its folder: aloha2cop, mohid2cop or cedre_json2cop.
+    The tools are imported once at start-up and run in the threads of a
+    bounded worker pool, so the scientific libraries stay imported and the
+    database connections of the pool stay open between files.
+
+    Scheduling runs on asyncio:
+        * each folder has a scanner polling it every "poll interval" seconds,
+          which dispatches a file once its size and mtime have been stable for
+          "settle time" seconds (the producer has finished writing it);
+        * each folder has its own bounded queue and "concurrency" consumers,
+          and "workers" caps the pipelines running at once across all folders;
+        * a full queue blocks the scanner of its folder only (backpressure):
+          files stay on disk and are picked up by a later scan, nothing is
+          dropped, and the other folders keep being served.
+
+    Every file of a folder is its own simulation: the configured one suffixed
+    with the file name, as in ALOHA batch runs ("simulation per file": false
+    keeps the configured simulation for every file). A file is counted as
+    ingested only if its pipeline loaded it; with a "manifest" configured, a
+    file already ingested with the same configuration is skipped, also across
+    restarts of the daemon.
+
+    Notes:
+        netCDF4 is not thread safe, so folders of MOHID files should keep a
+        concurrency of 1. Process pools of the tools (MOHID "time series"
+        processes) start their workers with spawn, not fork, from the daemon
+        threads. Stage metrics are not reset between files: the run report
+        written after each file holds the totals since the daemon started.
+
+Run from this directory with the repository root on PYTHONPATH:
+    python cop_daemon.py
+Stop with Ctrl+C (or SIGTERM): queued files are discarded, running ones finish.
+
+Version: 1.0.0
+Date: 2026-02-17
+"""
+
+import os
+import signal
+import asyncio
+import fnmatch
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from common.readers.inout import read_input
+from common.metrics import metrics, setup_logging
+from common.tools import load_tool, get_file_simulation
+from common.database.pool import get_lent_connections, close_pools
+
+log = logging.getLogger(__name__)
+
+# Keys asked for when the JSON configuration does not exist yet
+INPUT_KEYS = ['watch']
+
+# Tools a folder can be dispatched to, with the files they take by default
+TOOL_PATTERNS = {
+    'aloha2cop': ['*.kml', '*.kmz'],
+    'mohid2cop': ['*.hdf5', '*.hdf', '*.h5', '*.nc'],
+    'cedre_json2cop': ['*.json'],
+}
+
+DEFAULT_POLL_INTERVAL = 0.2
+DEFAULT_SETTLE_TIME = 0.5
+DEFAULT_QUEUE_SIZE = 100
+
+
+class WatchFolder:
+    """A drop folder, the tool its files go to and the scheduling limits of that tool."""
+
+    def __init__(self, watch, queue_size=DEFAULT_QUEUE_SIZE):
+        self.folder = os.path.abspath(watch['folder'])
+        os.makedirs(self.folder, exist_ok=True)
+        self.tool = watch['tool']
+        if self.tool not in TOOL_PATTERNS:
+            raise ValueError(f'No pipeline for files of tool: {self.tool}')
+        self.patterns = watch.get('patterns') or TOOL_PATTERNS[self.tool]
+        self.concurrency = watch.get('concurrency', 1)
+        self.simulation_per_file = watch.get('simulation per file', True)
+        # Configuration of the tool, without its file_in, read once
+        self.config = dict(read_input(watch['config'], [])) if watch.get('config') else {}
+        self.config.update(watch.get('options') or {})
+        self.module = load_tool(self.tool)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # Files seen in this folder: path -> (size, mtime_ns) of the last scan or dispatch
+        self.pending = {}
+        self.dispatched = {}
+
+    def list_files(self):
+        """(path, size, mtime_ns) of the files of the folder matching its patterns."""
+        files = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file() and any(fnmatch.fnmatch(entry.name, pattern) for pattern in self.patterns):
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return sorted(files, key=lambda file: file[2])
+
+    def get_ready_files(self, now, settle_time):
+        """Files not dispatched yet (or modified since) whose size and mtime did not change for settle_time."""
+        ready = []
+        present = set()
+        for path, size, mtime_ns in self.list_files():
+            present.add(path)
+            signature = (size, mtime_ns)
+            if self.dispatched.get(path) == signature:
+                continue
+            seen = self.pending.get(path)
+            if seen is None or seen[0] != signature:
+                self.pending[path] = (signature, now)
+            elif now - seen[1] >= settle_time:
+                ready.append((path, signature))
+        # Forget the files removed from the folder
+        for path in set(self.pending) - present:
+            del self.pending[path]
+        for path in set(self.dispatched) - present:
+            del self.dispatched[path]
+        return ready
+
+    def get_inputs(self, file_in, manifest=None):
+        inputs = dict(self.config, file_in=file_in)
+        if self.simulation_per_file and inputs.get('simulation'):
+            inputs['simulation'] = get_file_simulation(inputs['simulation'], file_in)
+        if manifest:
+            inputs['manifest'] = manifest
+        return inputs
+
+
+class Daemon:
+    """Per-folder scanners and consumers sharing one bounded pool of worker threads."""
+
+    def __init__(self, inputs):
+        self.poll_interval = inputs.get('poll interval', DEFAULT_POLL_INTERVAL)
+        self.settle_time = inputs.get('settle time', DEFAULT_SETTLE_TIME)
+        self.manifest = inputs.get('manifest')
+        queue_size = inputs.get('queue size', DEFAULT_QUEUE_SIZE)
+        self.folders = [WatchFolder(watch, queue_size) for watch in inputs['watch']]
+        self.workers = inputs.get('workers') or sum(folder.concurrency for folder in self.folders)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cop_daemon')
+        self.slots = asyncio.Semaphore(self.workers)
+        self.scanners = []
+        self.n_ingested, self.n_skipped, self.n_failed = 0, 0, 0
+        self.n_running = 0
+
+    async def scan(self, folder):
+        """Poll a folder and queue its files that are ready; waits while its queue is full."""
+        loop = asyncio.get_running_loop()
+        while True:
+            ready = folder.get_ready_files(loop.time(), self.settle_time)
+            for path, signature in ready:
+                await folder.queue.put(path)
+                folder.dispatched[path] = signature
+                folder.pending.pop(path, None)
+                log.debug('Queued %s for %s (%s waiting)', path, folder.tool, folder.queue.qsize())
+            await asyncio.sleep(self.poll_interval)
+
+    async def consume(self, folder):
+        loop = asyncio.get_running_loop()
+        while True:
+            file_in = await folder.queue.get()
+            try:
+                async with self.slots:
+                    start = loop.time()
+                    log.info('%s: %s', folder.tool, file_in)
+                    self.n_running += 1
+                    try:
+                        ids = await loop.run_in_executor(self.executor, self.run, folder, file_in)
+                    finally:
+                        self.n_running -= 1
+                    if ids is None:
+                        self.n_skipped += 1
+                        log.info('%s: %s not recorded as ingested (skipped, or not loaded whole)',
+                                 folder.tool, file_in)
+                    else:
+                        self.n_ingested += 1
+                        log.info('%s: %s done in %.2f s', folder.tool, file_in, loop.time() - start)
+            except Exception as e:
+                self.n_failed += 1
+                log.error('ERROR: %s failed on %s: %s', folder.tool, file_in, e)
+                self.check_pool()
+            finally:
+                folder.queue.task_done()
+
+    def run(self, folder, file_in):
+        """Pipeline of a file, in a worker thread: the ids it loaded, None if it loaded nothing."""
+        try:
+            return folder.module.main(folder.get_inputs(file_in, self.manifest))
+        except SystemExit as e:
+            # The tools exit on a lost database connection: fail this file, keep the daemon
+            raise RuntimeError(f'exited with {e.code}') from e
+
+    def check_pool(self):
+        """
+        After a failure: with no pipeline running, every connection should be back in the pool.
+        Connections still lent were leaked, and their slots with them: the pools are closed,
+        so the next file opens a new one instead of waiting on an exhausted pool.
+        """
+        if self.n_running:
+            return
+        n_lent = get_lent_connections()
+        if n_lent:
+            log.error('ERROR: %s database connections were not given back to the pool, opening a new pool', n_lent)
+            close_pools()
+
+    def stop(self):
+        log.info('Stopping: running ingestions will finish')
+        for scanner in self.scanners:
+            scanner.cancel()
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        # Cancelled by stop, also while they wait on a full queue
+        self.scanners = [asyncio.create_task(self.scan(folder)) for folder in self.folders]
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        consumers = [asyncio.create_task(self.consume(folder))
+                     for folder in self.folders for _ in range(folder.concurrency)]
+        for folder in self.folders:
+            log.info('Watching %s (%s) -> %s, concurrency %s',
+                     folder.folder, ", ".join(folder.patterns), folder.tool, folder.concurrency)
+        await asyncio.gather(*self.scanners, return_exceptions=True)
+        for consumer in consumers:
+            consumer.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+        log.info('Files ingested: %s (%s not ingested, %s failed)', self.n_ingested, self.n_skipped, self.n_failed)
+
+
+def main(inputs):
+
+    async def serve():
+        await Daemon(inputs).serve()
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    inputs = read_input('cop_daemon.json', INPUT_KEYS)
+    setup_logging(inputs.get('log level', 'INFO'))
+    metrics.reset('cop_daemon')
+    main(inputs)
@@ -43,15 +43,60 @@ Version: 1.0.0
 Date: 2026-02-16
 """
 
+import logging
 from datetime import datetime
 from common.readers.inout import read_input
+from common.metrics import metrics, setup_logging
 from mohid_reader import Mohid
 from common.database.cop_sql import CopQuery
+from common.readers.field_cache import FieldCache, ReductionState
+from common.database.manifest import ingest_once
 
+log = logging.getLogger(__name__)
 
-def main(inputs):
+# Keys asked for when the JSON configuration does not exist yet
+INPUT_KEYS = ['file_in', 'campaign', 'model', 'simulation', 'levels']
+
+
+def ingest_time_series(db_query, mohid, id_simulation, time_series, precision=None):
     """
-    Main execution flow for MOHID data ingestion.
+    Contour every timestep in parallel and load each one, in timestep order,
+    as its own output of the simulation.
+    """
+    output_type = time_series.get('output type', 'LOC AREAS TIMESTEP')
+    mohid.parse_threat_zones_by_time(time_series.get('processes'), precision)
+
+    for date, threat_zones in mohid.time_series:
+        id_output = db_query.set_id_output(id_simulation, date, output_type)
+        id_loc = db_query.set_id_loc(id_output, mohid.loc_type)
+        for threat_zone in threat_zones:
+            if threat_zone.coordinates:
+                db_query.set_line(id_loc, threat_zone.name, threat_zone.coordinates, threat_zone.description)
+        log.info('Ingested timestep: %s', date)
+
+
+def ingest_exposure(db_query, mohid, id_simulation, initial_datetime, exposure, precision=None):
+    """
+    Contour the exposure statistics, all computed in one pass over the file, and load
+    each one as its own output of the simulation (LOC AREAS <STATISTIC> by default).
+    """
+    statistics = exposure.get('statistics', ['first exceedance', 'time above', 'dose'])
+    mohid.parse_exposure_zones(statistics, exposure.get('duration', 60))
+
+    for statistic, threat_zones in mohid.exposure_zones.items():
+        output_type = f"{exposure.get('output type', 'LOC AREAS')} {statistic.upper()}"
+        id_output = db_query.set_id_output(id_simulation, initial_datetime, output_type)
+        id_loc = db_query.set_id_loc(id_output, mohid.loc_type)
+        for threat_zone in threat_zones:
+            if threat_zone.coordinates:
+                db_query.set_line(id_loc, threat_zone.name, threat_zone.coordinates, threat_zone.description,
+                                  precision)
+        log.info('Ingested exposure: %s', statistic)
+
+
+def ingest(inputs):
+    """
+    Ingestion of a MOHID file: returns the ids to record in the manifest, None if nothing was ingested.
     """
     # 1. Extract inputs from JSON configuration
     file_in = inputs['file_in']
@@ -59,13 +104,31 @@ def main(inputs):
     model = inputs['model']
     simulation = inputs['simulation']
     levels = inputs['levels']
-
-    print(f'Processing file: {file_in}')
+    # Optional memory budget (MB) for the time reduction of the concentration field
+    memory_budget = inputs.get('memory budget')
+    if memory_budget:
+        memory_budget = memory_budget * 1024 ** 2
+
+    # Optional region of interest: bounding box [lon_min, lat_min, lon_max, lat_max] and grid stride
+    region = inputs.get('region') or {}
+    # Optional on-disk cache of the maximum field: directory and size limit (MB)
+    cache = None
+    if inputs.get('cache'):
+        cache = FieldCache(inputs['cache']['dir'], inputs['cache'].get('max size', 1024) * 1024 ** 2)
+    # Optional incremental mode for files still being written: directory of the running maximum
+    state = None
+    if inputs.get('incremental'):
+        state = ReductionState(inputs['incremental']['dir'])
+
+    log.info('Processing file: %s', file_in)
 
     # 2. Initialize MOHID Reader and parse threat zones (Isolines)
     # This processes the HDF5/NetCDF to find the spatial polygons
-    mohid = Mohid(file_in, levels['type'], levels['level'])
-    mohid.parse_threat_zones()
+    mohid = Mohid(file_in, levels['type'], levels['level'], memory_budget,
+                  region.get('bbox'), region.get('stride', 1), cache, state, inputs.get('field'))
+    if not mohid.parse_threat_zones():
+        log.info('No data in %s, nothing ingested', file_in)
+        return None
 
     # Get the reference date from the model output
     initial_datetime = mohid.threat_zones[0].date
@@ -74,34 +137,69 @@ def main(inputs):
     db_query = CopQuery()
     db_query.connect()
 
-    # Set Campaign and Model identifiers
-    db_query.set_id_campaign(campaign['name'], campaign['description'])
-    db_query.set_id_model(model)
-
-    # Set Simulation context
-    db_query.set_id_simulation(campaign['name'], model, simulation['name'], simulation['description'])
-    id_simulation = db_query.get_id_simulation_by_chars(campaign['name'], model, simulation['name'])
-
-    # Define the output group (LOC AREAS)
-    db_query.set_id_output(id_simulation, initial_datetime, 'LOC AREAS')
-    id_output = db_query.get_id_output(id_simulation, initial_datetime, 'LOC AREAS')
+    try:
+        # Campaign -> Model -> Simulation -> Output (LOC AREAS) -> Level of Concern type (e.g., AEGL)
+        id_simulation, id_loc = db_query.set_simulation_loc(campaign, model, simulation, initial_datetime,
+                                                            mohid.loc_type)
+
+        # 4. Ingest calculated geometries into the database
+        threat_zones = [threat_zone for threat_zone in mohid.threat_zones if threat_zone.coordinates]
+        if state is not None:
+            for threat_zone in threat_zones:
+                if threat_zone.changed:
+                    # Incremental refresh: replace the lines whose isoline moved
+                    log.info('Updating Level: %s', threat_zone.name)
+                    db_query.upsert_line(id_loc, threat_zone.name, threat_zone.coordinates,
+                                         threat_zone.description, inputs.get('precision'))
+        else:
+            for threat_zone in threat_zones:
+                log.info('Ingesting Level: %s', threat_zone.name)
+            n_lines = db_query.set_lines(id_loc, [(threat_zone.name, threat_zone.coordinates,
+                                                   threat_zone.description) for threat_zone in threat_zones],
+                                         inputs.get('precision'))
+            # The lines of a LOC are never replaced: a file whose LOC already has them loaded nothing
+            if threat_zones and not n_lines:
+                log.warning('CAUTION: LOC %s already has the lines of %s, nothing ingested', id_loc, file_in)
+                return None
+
+        # The running maximum is saved only now: if a write failed, the next refresh folds the same timesteps again
+        mohid.store_state()
+
+        # 5. Optional exposure statistics (first exceedance, time above, dose) as extra outputs
+        if inputs.get('exposure'):
+            ingest_exposure(db_query, mohid, id_simulation, initial_datetime, inputs['exposure'],
+                            inputs.get('precision'))
+
+        # 6. Optional time-resolved ingestion: isolines of every timestep
+        if inputs.get('time series'):
+            ingest_time_series(db_query, mohid, id_simulation, inputs['time series'], inputs.get('precision'))
+
+    except Exception:
+        db_query.rollback()
+        raise
+    finally:
+        # The connection always goes back to the pool, whatever failed
+        db_query.close()
+
+    log.info('\n--------------- SUCCESSFUL INGESTION --------------')
+    return {'simulation': id_simulation, 'loc': id_loc}
 
-    # Associate the specific Level of Concern type (e.g., AEGL)
-    db_query.set_id_loc(id_output, mohid.loc_type)
-    id_loc = db_query.get_loc_id_by_type(id_output, mohid.loc_type)
 
-    # 4. Ingest calculated geometries into the database
-    for threat_zone in mohid.threat_zones:
-        if threat_zone.coordinates:
-            print(f'Ingesting Level: {threat_zone.name}')
-            db_query.set_line(id_loc, threat_zone.name, threat_zone.coordinates, threat_zone.description)
-
-    db_query.con.close()
-    print('\n--------------- SUCCESSFUL INGESTION --------------')
+def main(inputs):
+    """
+    Main execution flow for MOHID data ingestion.
+    Returns the ids recorded, None if the file was not ingested.
+    """
+    # Optional manifest of the inputs already ingested: an unchanged file is skipped before reading it
+    ids = ingest_once(inputs.get('manifest'), inputs['file_in'], 'mohid2cop', inputs, lambda: ingest(inputs))
+    # Stage timings and counters: logged, and written as JSON / Prometheus textfile if configured
+    metrics.export(inputs.get('metrics'))
+    return ids
 
 
 if __name__ == "__main__":
     # Load configuration keys from JSON
-    input_keys = ['file_in', 'campaign', 'model', 'simulation', 'levels']
-    inputs = read_input('mohid2cop.json', input_keys)
+    inputs = read_input('mohid2cop.json', INPUT_KEYS)
+    setup_logging(inputs.get('log level', 'INFO'))
+    metrics.reset('mohid2cop')
     main(inputs)
\ No newline at end of file
@@ -3,10 +3,142 @@ mohid_reader: Spatial processing for MOHID outputs.
 Part of the MANIFESTS-Genius Project.
 """
 
-from skimage.measure import find_contours
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
 from common.readers.reader_factory import read_factory
+from common.readers.prefetch import Prefetcher, DEFAULT_DEPTH
+from common.database.geometry import to_wkb
+from common.metrics import metrics, init_worker
+from common.tools import get_process_context
 import numpy as np
-from scipy.interpolate import interp1d
+
+log = logging.getLogger(__name__)
+
+# Default memory (bytes) that a reduction may use to hold a block of timesteps
+DEFAULT_MEMORY_BUDGET = 256 * 1024 ** 2
+
+# Fields rasterized from the particle positions (spill_latitude/spill_longitude) and whether
+# they are divided by the cell area
+PARTICLE_FIELDS = {'particle_count': False, 'particle_density': True}
+# Variables of the particle positions the particle fields are rasterized from
+PARTICLE_VARIABLES = ('spill_latitude', 'spill_longitude')
+
+# Per-cell exposure statistics the aggregate engine can accumulate
+EXPOSURE_STATISTICS = ('maximum', 'first exceedance', 'time above', 'dose')
+
+
+class GridAxis:
+    """
+    Maps fractional grid indexes to coordinates along one axis of the grid.
+    Whether the axis is uniformly spaced is worked out once: uniform axes use a
+    closed-form affine transform, irregular ones fall back to np.interp.
+    Indexes outside the axis map to NaN.
+    """
+
+    def __init__(self, values, rtol=1e-6):
+        values = np.asarray(values)
+        self.values = values.astype(float)
+        self.size = self.values.size
+        self.origin = self.values[0] if self.size else np.nan
+        self.step = None
+        if self.size >= 2:
+            steps = np.diff(self.values)
+            # Spacing differences below the storage precision of the coordinates do not count
+            dtype = values.dtype if np.issubdtype(values.dtype, np.floating) else np.float64
+            atol = 4 * np.finfo(dtype).eps * np.abs(self.values).max()
+            if steps[0] != 0 and np.allclose(steps, steps[0], rtol=rtol, atol=atol):
+                self.step = (self.values[-1] - self.values[0]) / (self.size - 1)
+
+    @property
+    def is_uniform(self):
+        return self.step is not None
+
+    def map(self, indexes):
+        indexes = np.asarray(indexes, dtype=float)
+        if self.is_uniform:
+            coordinates = self.origin + self.step * indexes
+            coordinates[(indexes < 0) | (indexes > self.size - 1)] = np.nan
+            return coordinates
+        return np.interp(indexes, np.arange(self.size), self.values, left=np.nan, right=np.nan)
+
+
+class ParticleRasterizer:
+    """
+    Bins particle positions onto the cells of the model grid.
+    Each particle gets the flat index of its cell (closed-form on uniform axes, a binary
+    search otherwise) and np.bincount accumulates all of them at once, so a timestep of
+    millions of particles needs no Python loop. Particles outside the grid, or with
+    non-finite positions, are dropped. Descending axes are binned on their flipped edges
+    and the field flipped back, so it follows the order of the grid.
+    """
+
+    def __init__(self, latitudes, longitudes, corners=False):
+        """latitudes/longitudes: 1D cell corners (corners=True) or cell centres of the grid"""
+        latitude_edges = self.get_edges(latitudes, corners)
+        longitude_edges = self.get_edges(longitudes, corners)
+        self.latitude_flipped = latitude_edges[0] > latitude_edges[-1]
+        self.longitude_flipped = longitude_edges[0] > longitude_edges[-1]
+        self.latitude_edges = latitude_edges[::-1] if self.latitude_flipped else latitude_edges
+        self.longitude_edges = longitude_edges[::-1] if self.longitude_flipped else longitude_edges
+        self.shape = (self.latitude_edges.size - 1, self.longitude_edges.size - 1)
+        self.latitude_axis = GridAxis(self.latitude_edges)
+        self.longitude_axis = GridAxis(self.longitude_edges)
+
+    @staticmethod
+    def get_edges(values, corners=False):
+        """Cell edges of an axis: the corners themselves, or the midpoints between centres."""
+        values = np.asarray(values, dtype=float)
+        if corners:
+            return values
+        middle = (values[1:] + values[:-1]) / 2
+        return np.concatenate(([2 * values[0] - middle[0]], middle, [2 * values[-1] - middle[-1]]))
+
+    def get_cell_areas(self):
+        """Area (km2) of every cell on a spherical Earth."""
+        km_per_degree = 111.32
+        heights = np.diff(self.latitude_edges) * km_per_degree
+        widths = np.diff(self.longitude_edges) * km_per_degree
+        centres = np.radians((self.latitude_edges[1:] + self.latitude_edges[:-1]) / 2)
+        return np.abs(np.outer(heights * np.cos(centres), widths))
+
+    @staticmethod
+    def get_cell_indexes(axis, edges, values):
+        """Cell of every value along one axis of ascending edges, -1 when outside them or not finite."""
+        indexes = np.full(values.shape, -1, dtype=np.int64)
+        # NaN compares False, so non-finite positions stay at -1 and are never cast
+        inside = (values >= edges[0]) & (values <= edges[-1])
+        values = values[inside]
+        if axis.is_uniform:
+            cells = np.floor((values - axis.origin) / axis.step).astype(np.int64)
+        else:
+            cells = np.searchsorted(edges, values, side='right') - 1
+        # A value on the last edge belongs to the last cell
+        indexes[inside] = np.clip(cells, 0, edges.size - 2)
+        return indexes
+
+    def rasterize(self, latitudes, longitudes, weights=None, density=False):
+        """
+        Field [lat, lon] with the number of particles (or the sum of their weights) in each cell,
+        divided by the cell area when density is True.
+        """
+        latitudes = np.ravel(np.ma.filled(latitudes, np.nan)).astype(float, copy=False)
+        longitudes = np.ravel(np.ma.filled(longitudes, np.nan)).astype(float, copy=False)
+        rows = self.get_cell_indexes(self.latitude_axis, self.latitude_edges, latitudes)
+        cols = self.get_cell_indexes(self.longitude_axis, self.longitude_edges, longitudes)
+        inside = (rows >= 0) & (cols >= 0)
+        cells = rows[inside] * self.shape[1] + cols[inside]
+        if weights is not None:
+            weights = np.ravel(weights)[inside]
+        field = np.bincount(cells, weights=weights, minlength=self.shape[0] * self.shape[1])
+        field = field.reshape(self.shape).astype(float)
+        if density:
+            field /= self.get_cell_areas()
+        if self.latitude_flipped:
+            field = field[::-1]
+        if self.longitude_flipped:
+            field = field[:, ::-1]
+        return field
 
 
 class IsolineExtractor:
@@ -20,57 +152,384 @@ class IsolineExtractor:
         self.longitudes = longitudes
         self.dataset = dataset
         self.levels = levels
+        self.latitude_axis = GridAxis(latitudes)
+        self.longitude_axis = GridAxis(longitudes)
 
+    @metrics.timed('contour')
     def extract_isolines(self):
         """
-        Converts pixel-based contours into WKT (Well-Known Text) Polygons.
+        Builds a Shapely Polygon (MultiPolygon for disjoint plumes) per level from its contours,
+        in the order of self.levels (None if the level has no contour).
         """
         isolines = []
-        for level in self.levels:
-            # Detect contours at specific concentration value
-            contours = find_contours(self.dataset, level)
-            if contours:
-                wkt = "POLYGON("
-                for contour in contours:
-                    # Map pixel indexes back to real Lat/Lon via interpolation
-                    lats_contour = self.interpolate_array(contour[:, 1], self.latitudes)
-                    lons_contour = self.interpolate_array(contour[:, 0], self.longitudes)
-
-                    coords = [(lat, lon) for lat, lon in zip(lats_contour, lons_contour)]
-                    wkt += "("
-                    for coord in coords:
-                        wkt += f"{coord[0]} {coord[1]},"
-                    wkt = wkt[:-1] + "),"  # Remove last comma and close ring
-                wkt = wkt[:-1] + ")"  # Close polygon
-                isolines.append(wkt)
+        for rings in self.extract_contours():
+            rings = [ring for ring in rings if len(ring) >= 3]
+            isolines.append(self.build_polygon(rings) if rings else None)
+        metrics.count('isolines', sum(isoline is not None for isoline in isolines))
         return isolines
 
+    @staticmethod
+    def build_polygon(rings):
+        """
+        Polygon of the contour rings of one level. Contours of a level never cross, so a ring
+        inside an even number of other rings is a shell and one inside an odd number is a hole
+        of the ring just outside it. Several shells make a MultiPolygon.
+        """
+        import shapely
+        ring_ids = np.repeat(np.arange(len(rings)), [len(ring) for ring in rings])
+        linear_rings = shapely.linearrings(np.concatenate(rings), indices=ring_ids)
+        # inside[j, i]: ring i lies inside ring j (tested on one of its vertices)
+        inside = shapely.contains(shapely.polygons(linear_rings)[:, np.newaxis],
+                                  shapely.points([ring[0] for ring in rings])[np.newaxis, :])
+        np.fill_diagonal(inside, False)
+        depth = inside.sum(axis=0)
+
+        holes = {n: [] for n in np.flatnonzero(depth % 2 == 0)}
+        for n in np.flatnonzero(depth % 2 == 1):
+            shell = np.flatnonzero(inside[:, n] & (depth == depth[n] - 1))
+            if shell.size:
+                holes[shell[0]].append(linear_rings[n])
+        polygons = [shapely.polygons(linear_rings[n], holes=shell_holes or None) for n, shell_holes in holes.items()]
+        polygon = polygons[0] if len(polygons) == 1 else shapely.multipolygons(polygons)
+        if not shapely.is_valid(polygon):
+            log.warning('CAUTION: invalid isoline (%s), repaired', shapely.is_valid_reason(polygon))
+            polygon = shapely.make_valid(polygon)
+        return polygon
+
+    def extract_contours(self):
+        """
+        Contours of every level, mapped to geographical coordinates: marching squares over
+        the whole grid, then one batched interpolation per level.
+        Returns, in the order of self.levels, a list of (n, 2) coordinate arrays per level.
+        """
+        from skimage.measure import find_contours
+        field = np.asarray(self.dataset, dtype=float)
+        contours_by_level = []
+        for level in self.levels:
+            contours = find_contours(field, level)
+            contours_by_level.append(self.map_contours(contours) if contours else [])
+        return contours_by_level
+
+    @staticmethod
+    def get_changed_levels(previous, field, levels):
+        """
+        Whether the isoline of each level can differ between two versions of a field.
+        An isoline only depends on the cells its level crosses, so a level is flagged when
+        a cell with a changed corner crosses it in either version.
+        """
+        previous = np.asarray(previous, dtype=float)
+        field = np.asarray(field, dtype=float)
+        changed_nodes = ~((previous == field) | (np.isnan(previous) & np.isnan(field)))
+        changed_cells = (changed_nodes[:-1, :-1] | changed_nodes[:-1, 1:] |
+                         changed_nodes[1:, :-1] | changed_nodes[1:, 1:])
+        if not changed_cells.any():
+            return [False for _ in levels]
+
+        corners = [array[rows, cols] for array in (previous, field)
+                   for rows, cols in ((slice(None, -1), slice(None, -1)), (slice(None, -1), slice(1, None)),
+                                      (slice(1, None), slice(None, -1)), (slice(1, None), slice(1, None)))]
+        cell_min = np.fmin.reduce(corners)[changed_cells]
+        cell_max = np.fmax.reduce(corners)[changed_cells]
+        return [bool(np.any((cell_min <= level) & (level <= cell_max))) for level in levels]
+
+    def map_contours(self, contours):
+        """Map a list of pixel contours to Lat/Lon with one interpolation per axis."""
+        indexes = np.concatenate(contours)
+        coordinates = np.column_stack((self.latitude_axis.map(indexes[:, 1]),
+                                       self.longitude_axis.map(indexes[:, 0])))
+        return np.split(coordinates, np.cumsum([len(contour) for contour in contours])[:-1])
+
     @staticmethod
     def interpolate_array(indexes, field):
         """Map grid indices to geographical coordinates."""
-        x_interp = np.array(indexes)
-        y_interp = np.array(field)
-        x = np.arange(y_interp.size)
-        interp_func = interp1d(x, y_interp, kind='linear', bounds_error=False, fill_value=np.nan)
-        return interp_func(x_interp)
+        return GridAxis(field).map(indexes)
+
+
+class ExposureAggregator:
+    """
+    Per-cell exposure statistics of a variable, accumulated in a single pass over its timesteps.
+    Times are minutes since the first timestep; durations use trapezoidal weights.
+        maximum:          maximum value
+        first exceedance: time each level is first reached (NaN if never)
+        time above:       time spent at or above each level
+        dose:             time-integrated value (value * minutes)
+    """
+
+    def __init__(self, times, levels, statistics=EXPOSURE_STATISTICS):
+        unknown = set(statistics) - set(EXPOSURE_STATISTICS)
+        if unknown:
+            raise ValueError(f'Unknown exposure statistics: {sorted(unknown)}')
+        self.statistics = list(statistics)
+        self.levels = np.asarray(levels, dtype=float)
+        times = np.asarray(times, dtype='datetime64[s]')
+        self.elapsed = (times - times[0]).astype(float) / 60
+        steps = np.diff(self.elapsed)
+        self.weights = np.zeros_like(self.elapsed)
+        self.weights[:-1] += steps / 2
+        self.weights[1:] += steps / 2
+        self.n_time = 0
+        self.maximum = None
+        self.first_exceedance = None
+        self.time_above = None
+        self.dose = None
+
+    def update(self, block):
+        """Fold the next block of timesteps [time, lat, lon] into the accumulators."""
+        block = np.ma.filled(block, np.nan)
+        weights = self.weights[self.n_time:self.n_time + len(block)]
+        elapsed = self.elapsed[self.n_time:self.n_time + len(block)]
+        self.n_time += len(block)
+        if self.maximum is None:
+            shape = block.shape[1:]
+            self.maximum = np.full(shape, np.nan)
+            self.first_exceedance = np.full((len(self.levels),) + shape, np.nan)
+            self.time_above = np.zeros((len(self.levels),) + shape)
+            self.dose = np.zeros(shape)
+
+        if 'maximum' in self.statistics:
+            np.fmax(self.maximum, np.fmax.reduce(block, axis=0), out=self.maximum)
+        if 'dose' in self.statistics:
+            self.dose += np.tensordot(weights, np.nan_to_num(block), axes=1)
+        if 'first exceedance' in self.statistics or 'time above' in self.statistics:
+            for n, level in enumerate(self.levels):
+                exceeds = block >= level
+                if 'time above' in self.statistics:
+                    self.time_above[n] += np.tensordot(weights, exceeds, axes=1)
+                if 'first exceedance' in self.statistics:
+                    reached = exceeds.any(axis=0) & np.isnan(self.first_exceedance[n])
+                    self.first_exceedance[n][reached] = elapsed[exceeds.argmax(axis=0)][reached]
+
+    def get_zone_fields(self, statistic, duration):
+        """
+        Field and threshold to contour for each level, so that the zone of a level is
+        where the field is at or above its threshold:
+            maximum:          the level is reached
+            first exceedance: the level is reached within `duration` minutes
+            time above:       the level is exceeded for at least `duration` minutes
+            dose:             the dose reaches the level held for `duration` minutes
+        """
+        if statistic == 'maximum':
+            return [(self.maximum, level) for level in self.levels]
+        if statistic == 'dose':
+            return [(self.dose, level * duration) for level in self.levels]
+        if statistic == 'time above':
+            return [(time_above, duration) for time_above in self.time_above]
+        # Cells never reached count as reached one step after the last timestep
+        never = self.elapsed[-1] + (self.elapsed[-1] - self.elapsed[-2] if len(self.elapsed) > 1 else 1)
+        return [(-np.where(np.isnan(first), never, first), -duration) for first in self.first_exceedance]
 
 
 class LagrangianFile:
-    def __init__(self, file_in):
-        factory = read_factory(file_in)
-        self.reader = factory.get_reader()
+    def __init__(self, file_in, memory_budget=None, bbox=None, stride=1, prefetch=DEFAULT_DEPTH):
+        """
+        prefetch: timesteps (or blocks) read ahead in a background thread, 0 reads in the caller's thread
+        (always, for readers that are not thread safe such as NetCDF)
+        """
+        self.file_in = file_in
+        self.bbox = bbox
+        self.stride = stride
+        self.prefetch = prefetch
+        with metrics.stage('open'):
+            factory = read_factory(file_in, bbox=bbox, stride=stride)
+            self.reader = factory.get_reader()
+        if not self.reader.thread_safe:
+            self.prefetch = 0
+        self.memory_budget = memory_budget or DEFAULT_MEMORY_BUDGET
+        self.times = self.reader.times
+        self.time_keys = [int(key) for key in self.reader.time_keys]
         self.dates = self.get_dates()
         self.latitudes = self.reader.latitudes
         self.longitudes = self.reader.longitudes
+        self.rasterizer = None
+
+    def get_rasterizer(self):
+        if self.rasterizer is None:
+            missing = [name for name in PARTICLE_VARIABLES if not self.reader.has_var(name)]
+            if missing:
+                raise ValueError(f'{self.file_in} has no particle positions ({", ".join(missing)}), '
+                                 f'needed by the fields {", ".join(PARTICLE_FIELDS)}')
+            self.rasterizer = ParticleRasterizer(self.latitudes, self.longitudes, self.reader.cell_corners)
+        return self.rasterizer
+
+    def get_particle_field(self, variable, n_time):
+        """Particles of a timestep binned onto the grid (a field of PARTICLE_FIELDS)."""
+        latitudes = self.reader.get_variable('spill_latitude', n_time)
+        longitudes = self.reader.get_variable('spill_longitude', n_time)
+        return self.get_rasterizer().rasterize(latitudes, longitudes, density=PARTICLE_FIELDS[variable])
+
+    def get_field(self, variable, n_time):
+        """One timestep of a variable read in memory, or rasterized from the particles."""
+        if variable in PARTICLE_FIELDS:
+            return self.get_particle_field(variable, n_time)
+        return np.array(self.reader.get_variable(variable, n_time))
+
+    def get_field_block(self, variable, n_times):
+        """A block of timesteps of a variable stacked into a single array."""
+        if variable in PARTICLE_FIELDS:
+            return np.stack([self.get_particle_field(variable, n_time) for n_time in n_times])
+        return self.reader.get_variable_block(variable, n_times)
 
     def get_dates(self):
-        return [self.reader.get_date(n + 1) for n, date_group in enumerate(self.reader.get_dates())]
+        return self.times.astype('datetime64[s]').tolist()
+
+    def get_date(self, n_time):
+        return self.reader.get_date(n_time)
+
+    def select_time_keys(self, start=None, end=None):
+        """Dataset keys of the timesteps inside the window [start, end] (both optional)."""
+        mask = np.ones(self.times.shape, dtype=bool)
+        if start is not None:
+            mask &= self.times >= np.datetime64(start, 's')
+        if end is not None:
+            mask &= self.times <= np.datetime64(end, 's')
+        return [key for key, selected in zip(self.time_keys, mask) if selected]
 
     def get_list_of_values(self, variable):
-        return [self.reader.get_variable(variable, n+1)[:] for n, date in enumerate(self.dates)]
+        return list(self.iter_values(variable))
+
+    def iter_prefetched(self, read, items):
+        """Yield read(item) for every item, read ahead in a background thread when prefetch is on."""
+        def timed_read(item):
+            with metrics.stage('read'):
+                values = read(item)
+            metrics.count('bytes read', values.nbytes)
+            return values
+
+        if not self.prefetch:
+            yield from map(timed_read, items)
+            return
+        with Prefetcher(timed_read, items, self.prefetch) as results:
+            yield from results
+
+    def iter_values(self, variable, time_keys=None):
+        """Yield every timestep of a variable (or those of time_keys) as an array read in memory."""
+        time_keys = self.time_keys if time_keys is None else time_keys
+        yield from self.iter_prefetched(lambda n_time: self.get_field(variable, n_time), time_keys)
+
+    def get_block_size(self, variable, memory_budget=None):
+        """
+        Number of timesteps of a variable that fit in the memory budget (at least one).
+        With prefetch, the blocks queued ahead, the one being read and the one in use share the budget.
+        """
+        memory_budget = (memory_budget or self.memory_budget) / ((self.prefetch + 2) if self.prefetch else 1)
+        if variable in PARTICLE_FIELDS:
+            field_nbytes = int(np.prod(self.get_rasterizer().shape)) * np.dtype(float).itemsize
+        else:
+            field_nbytes = self.reader.get_field_nbytes(variable, self.time_keys[0])
+        return max(1, int(memory_budget // max(field_nbytes, 1)))
+
+    def iter_blocks(self, variable, memory_budget=None, time_keys=None):
+        """Yield the timesteps of a variable as stacked blocks bounded by the memory budget."""
+        time_keys = self.time_keys if time_keys is None else time_keys
+        block_size = self.get_block_size(variable, memory_budget)
+        key_blocks = [time_keys[n:n + block_size] for n in range(0, len(time_keys), block_size)]
+        yield from self.iter_prefetched(lambda n_times: self.get_field_block(variable, n_times), key_blocks)
+
+    def get_maximum_field(self, variable, memory_budget=None, start=None, end=None, cache=None):
+        """
+        Running maximum of a variable over all timesteps (or those inside [start, end]).
+        Only one block of timesteps is held in memory at a time, so peak memory
+        is bounded by the memory budget plus the output field.
+        With a FieldCache, the field is read back from disk when this file, variable
+        and subset were already reduced.
+        """
+        if cache is not None:
+            key = cache.get_key(self.file_in, variable, 'maximum', bbox=self.bbox, stride=self.stride,
+                                start=start, end=end)
+            cached = cache.load(key)
+            if cached is not None:
+                log.info('Maximum of %s read from cache', variable)
+                return cached[0]
+            maximum = self.get_maximum_field(variable, memory_budget, start, end)
+            cache.store(key, maximum, self.latitudes, self.longitudes)
+            return maximum
+
+        return self.reduce_maximum(variable, self.select_time_keys(start, end), memory_budget)
+
+    @metrics.timed('reduce')
+    def reduce_maximum(self, variable, time_keys, memory_budget=None):
+        """Maximum of a variable over the given timesteps, folded block by block."""
+        maximum = None
+        for block in self.iter_blocks(variable, memory_budget, time_keys):
+            if maximum is None:
+                maximum = np.maximum.reduce(block, axis=0)
+            else:
+                np.maximum(maximum, np.maximum.reduce(block, axis=0), out=maximum)
+        return maximum
+
+    @metrics.timed('reduce')
+    def get_exposure(self, variable, levels, statistics=EXPOSURE_STATISTICS, memory_budget=None,
+                     start=None, end=None):
+        """
+        Exposure statistics of a variable over all timesteps (or those inside [start, end]),
+        computed in one read of the file with the memory bounded as in get_maximum_field.
+        Returns the filled ExposureAggregator.
+        """
+        time_keys = self.select_time_keys(start, end)
+        times = self.times[[self.reader.time_positions[n_time] for n_time in time_keys]]
+        aggregator = ExposureAggregator(times, levels, statistics)
+        for block in self.iter_blocks(variable, memory_budget, time_keys):
+            aggregator.update(block)
+        return aggregator
+
+    def update_maximum_field(self, variable, state, memory_budget=None):
+        """
+        Incremental maximum of a file that is still being written.
+        Only the timesteps after the last one saved in the ReductionState are read and
+        folded into the saved maximum. The saved maximum is dropped when the file was
+        rewritten since (its time axis starts elsewhere, or ends before the last timestep
+        folded) or the grid changed.
+        Returns (maximum, previous maximum or None if the reduction started from scratch,
+        state update): the new state is not saved here, the caller passes the update to
+        state.store once the maximum is safely used. (None, None, None) if no data yet.
+        """
+        if not self.time_keys:
+            return None, None, None
+        key = state.get_key(self.file_in, variable, 'maximum', bbox=self.bbox, stride=self.stride)
+        origin = state.get_origin(self.time_keys[0], self.dates[0])
+        previous, last_time_key, saved_origin = state.load(key)
+        if previous is not None and (saved_origin != origin or last_time_key > self.time_keys[-1]):
+            log.warning('CAUTION: %s was rewritten since the last refresh, the maximum starts again', self.file_in)
+            previous, last_time_key = None, None
+        new_keys = self.time_keys if last_time_key is None else [n for n in self.time_keys if n > last_time_key]
+        if not new_keys:
+            return previous, previous, None
+        log.info('Folding %s new timesteps of %s into the maximum', len(new_keys), variable)
+
+        maximum = self.reduce_maximum(variable, new_keys, memory_budget)
+        if previous is not None and previous.shape != maximum.shape:
+            log.warning('CAUTION: grid changed since the last refresh, the maximum starts again')
+            previous, new_keys = None, self.time_keys
+            maximum = self.reduce_maximum(variable, new_keys, memory_budget)
+        if previous is not None:
+            maximum = np.maximum(previous, maximum)
+        return maximum, previous, (key, maximum, new_keys[-1], origin)
+
+
+# Model file opened once by each process of the per-timestep pool
+_worker_file = None
+
+
+def _open_worker_file(file_in, bbox=None, stride=1):
+    """Process pool initializer: every worker opens its own handle on the model file."""
+    global _worker_file
+    init_worker()
+    _worker_file = LagrangianFile(file_in, bbox=bbox, stride=stride)
+
+
+def _contour_timestep(task):
+    """
+    Contour one timestep in a worker and return one WKB buffer (or None) per level,
+    with the metrics recorded by the worker since its last task.
+    """
+    dataset_name, levels, n_time, precision = task
+    with metrics.stage('read'):
+        dataset = _worker_file.get_field(dataset_name, n_time)
+    metrics.count('bytes read', dataset.nbytes)
+    extractor = IsolineExtractor(_worker_file.longitudes, _worker_file.latitudes, dataset, levels)
+    isolines = [None if isoline is None else to_wkb(isoline, precision) for isoline in extractor.extract_isolines()]
+    return isolines, metrics.take()
 
-    def get_maximum_field(self, variable):
-        return np.maximum.reduce(self.get_list_of_values(variable))
 
 class ThreatZone:
     """Class for threat zone"""
@@ -80,19 +539,34 @@ class ThreatZone:
         self.value = level['value']
         self.date = None
         self.coordinates = None
+        self.changed = True
 
 
 class Mohid:
     """Class for building database information from a mohid lagrangian file"""
 
-    def __init__(self, file, loc_type, levels):
+    def __init__(self, file, loc_type, levels, memory_budget=None, bbox=None, stride=1, cache=None, state=None,
+                 field=None):
         self.file = file
+        self.memory_budget = memory_budget
+        self.bbox = bbox
+        self.stride = stride
+        self.cache = cache
+        self.state = state
+        # Running maximum to save in state once the isolines are stored (see store_state)
+        self.state_update = None
         self.threat_zones = None
+        self.time_series = None
+        self.exposure_zones = None
+        self.levels = levels
         self.loc_type = loc_type
         self.category = None
         self.dataset_name = 'air_concentration_2D'
         if self.loc_type == 'LC50':
             self.dataset_name = 'dissolved_concentration_2D'
+        if field is not None:
+            # e.g. particle_density for runs that only write the particle positions
+            self.dataset_name = field
         self.set_category()
         self.set_threat_zones(levels)
 
@@ -104,20 +578,94 @@ class Mohid:
         self.category = category[self.loc_type]
 
     def parse_threat_zones(self):
-        lag_dataset = LagrangianFile(self.file)
+        """Isolines of the time maximum of every level; False if the file has no timestep yet."""
+        lag_dataset = LagrangianFile(self.file, self.memory_budget, self.bbox, self.stride)
         latitudes = lag_dataset.latitudes
         longitudes = lag_dataset.longitudes
 
-        print(f'dataset_name = {self.dataset_name}')
-        maximum_dataset = lag_dataset.get_maximum_field(self.dataset_name)
+        log.debug('dataset_name = %s', self.dataset_name)
         all_levels_values = [threat_zone.value for threat_zone in self. threat_zones]
-        extractor = IsolineExtractor(longitudes, latitudes, maximum_dataset, all_levels_values)
+        if not lag_dataset.time_keys:
+            log.warning('CAUTION: no timestep of %s in %s yet, no data', self.dataset_name, self.file)
+            return False
+        if self.state is not None:
+            # Incremental refresh: only new timesteps are read, only levels whose isoline moved are flagged
+            maximum_dataset, previous, self.state_update = lag_dataset.update_maximum_field(
+                self.dataset_name, self.state, self.memory_budget)
+            if previous is not None:
+                changed = IsolineExtractor.get_changed_levels(previous, maximum_dataset, all_levels_values)
+                for threat_zone, level_changed in zip(self.threat_zones, changed):
+                    threat_zone.changed = level_changed
+        else:
+            maximum_dataset = lag_dataset.get_maximum_field(self.dataset_name, cache=self.cache)
+        changed_zones = [threat_zone for threat_zone in self.threat_zones if threat_zone.changed]
+        extractor = IsolineExtractor(longitudes, latitudes, maximum_dataset,
+                                     [threat_zone.value for threat_zone in changed_zones])
         isolines = extractor.extract_isolines()
-        print('-------->', isolines)
-        for m, isoline in enumerate(isolines):
-            self.threat_zones[m].coordinates = isoline
-            self.threat_zones[m].date = lag_dataset.dates[0]
-            print('------------------------------->',m,  self.threat_zones[m].date)
+        # Lazy %-formatting: the WKT of the isolines is only built at DEBUG level
+        log.debug('Isolines: %s', isolines)
+        for threat_zone in self.threat_zones:
+            threat_zone.date = lag_dataset.dates[0]
+        for threat_zone, isoline in zip(changed_zones, isolines):
+            threat_zone.coordinates = isoline
+            log.debug('Threat zone %s at %s', threat_zone.name, threat_zone.date)
+        return True
+
+    def store_state(self):
+        """Save the running maximum of an incremental refresh; call it once its isolines are in the database."""
+        if self.state_update is not None:
+            self.state.store(*self.state_update)
+            self.state_update = None
+
+    def parse_exposure_zones(self, statistics, duration, start=None, end=None):
+        """
+        Threat zones of each exposure statistic, all computed in a single pass over the file.
+        Sets self.exposure_zones to a dict of statistic -> threat zones (one per level).
+        """
+        lag_dataset = LagrangianFile(self.file, self.memory_budget, self.bbox, self.stride)
+        all_levels_values = [threat_zone.value for threat_zone in self.threat_zones]
+        aggregator = lag_dataset.get_exposure(self.dataset_name, all_levels_values, statistics,
+                                              self.memory_budget, start, end)
+        date = lag_dataset.get_date(lag_dataset.select_time_keys(start, end)[0])
+
+        self.exposure_zones = {}
+        for statistic in statistics:
+            threat_zones = [ThreatZone(level) for level in self.levels]
+            zone_fields = aggregator.get_zone_fields(statistic, duration)
+            for threat_zone, (field, threshold) in zip(threat_zones, zone_fields):
+                extractor = IsolineExtractor(lag_dataset.longitudes, lag_dataset.latitudes, field, [threshold])
+                threat_zone.coordinates = extractor.extract_isolines()[0]
+                threat_zone.date = date
+            self.exposure_zones[statistic] = threat_zones
+
+    def parse_threat_zones_by_time(self, processes=None, precision=None, start=None, end=None):
+        """
+        Contour every timestep (or those inside [start, end]) on a process pool.
+        Each worker opens the file on its own and returns the isolines as WKB buffers.
+        Sets self.time_series to a list of (date, threat zones), in timestep order.
+        """
+        lag_dataset = LagrangianFile(self.file, self.memory_budget, self.bbox, self.stride)
+        time_keys = lag_dataset.select_time_keys(start, end)
+        all_levels_values = [threat_zone.value for threat_zone in self.threat_zones]
+        tasks = [(self.dataset_name, all_levels_values, n_time, precision) for n_time in time_keys]
+
+        processes = processes or os.cpu_count()
+        chunksize = max(1, len(tasks) // (processes * 4))
+        log.info('Contouring %s timesteps of %s with %s processes', len(tasks), self.dataset_name, processes)
+        with ProcessPoolExecutor(max_workers=processes, mp_context=get_process_context(),
+                                 initializer=_open_worker_file,
+                                 initargs=(self.file, self.bbox, self.stride)) as executor:
+            results = executor.map(_contour_timestep, tasks, chunksize=chunksize)
+
+            self.time_series = []
+            for n_time, (isolines, worker_metrics) in zip(time_keys, results):
+                metrics.merge(worker_metrics)
+                date = lag_dataset.get_date(n_time)
+                threat_zones = [ThreatZone(level) for level in self.levels]
+                for threat_zone, isoline in zip(threat_zones, isolines):
+                    threat_zone.coordinates = isoline
+                    threat_zone.date = date
+                self.time_series.append((date, threat_zones))
 
 
 
@@ -138,8 +686,8 @@ def main():
 
 
 
-    for n, date in enumerate(lag_dataset.get_dates()):
-        dataset = lag_dataset.reader.get_variable(dataset_name, n+1)
+    # The next timesteps are read in the background while the current one is contoured
+    for dataset, date in zip(lag_dataset.iter_values(dataset_name), lag_dataset.dates):
         print(date)
 
 